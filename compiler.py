@@ -48,6 +48,19 @@ class Compile(object):
         "bitShift:" : B_BIT_SHIFT_SPECIAL,
     }
     
+    # keyword messages compiled inline when the
+    # arguments are literal blocks
+    _Inline_Keyword = frozenset(("ifTrue:", "ifFalse:", "ifTrue:ifFalse:", "ifFalse:ifTrue:",
+                                 "and:", "or:", "whileTrue:", "whileFalse:"))
+    
+    # unary messages compiled inline when the
+    # receiver is a literal block
+    _Inline_Unary = frozenset(("whileTrue", "whileFalse"))
+    
+    # counted loop messages compiled inline when
+    # the last argument is a literal block
+    _Inline_Loop = frozenset(("to:do:", "to:by:do:", "timesRepeat:"))
+    
     # mapping for binary special messages
     _Special_Binary = {
         "+"     : B_PLUS_SPECIAL,
@@ -102,6 +115,7 @@ class Compile(object):
         self._cur_depth     = None
         self._max_depth     = None
         self._ctx_stack     = []
+        self._blk_flags     = []
         self._cat_cache     = weakref.WeakValueDictionary()
         
     def parse_file(self, fileName):
@@ -423,8 +437,9 @@ class Compile(object):
             self._max_depth = 1
             
         # set method header values
+        # inlined blocks may have added temporaries
         methObj.set_hdr(len(argNames), 
-                        len(tempNames), 
+                        len(self._cur_local) - len(argNames), 
                         self._max_depth,
                         primId)
         
@@ -451,6 +466,7 @@ class Compile(object):
             if methDict.is_nil():
                 self._cur_klass.methodDictionary = methDict = MethodDictionary.new_n(32)
         self._sys.identdict_add(methDict, methSym, methObj)
+        self._sys.g_interp.flush_cache()
             
         byteCode = methObj.get_code()
         if self._verbose:
@@ -647,6 +663,13 @@ class Compile(object):
         """
         Compile sending a unary message
         """
+        # compile loops inline
+        if (name in self._Inline_Unary) and not isSuper:
+            cond = self.literal_block(recv, 0)
+            if cond is not None:
+                self.compile_inline_while(cond, None, name == "whileTrue")
+                return
+                
         # get receiver
         if isinstance(recv, ParseUnaryMessage):
             self.compile_unary_message(recv.recv, recv.name)
@@ -699,6 +722,10 @@ class Compile(object):
         """
         Comple sending a message with named arguments
         """
+        # compile conditionals and loops inline
+        if (not isSuper) and self.compile_inline_message(recv, args):
+            return
+            
         # get receiver
         self.compile_exec_statement(recv.data)
 
@@ -722,14 +749,7 @@ class Compile(object):
         
         # get and push argument values
         for a in argValues:
-            if isinstance(a, ParseLiteral):
-                self.compile_load_literal(a.value)
-            elif isinstance(a, ParseUnaryMessage):
-                self.compile_unary_message(a.recv, a.name, a.sup)
-            elif isinstance(a, ParseExecStatement):
-                self.compile_exec_statement(a.data)
-            else:
-                raise CompileError("bad message argument syntax "  + str(self._cur_meth))
+            self.compile_arg_value(a)
             
         # send message
         if isSpecial:
@@ -740,6 +760,242 @@ class Compile(object):
             else:
                 self.emit_bytes(-1 - numArgs, B_SEND, numArgs)
         
+    def compile_arg_value(self, a):
+        """
+        Compile the code to push a message argument value
+        """
+        if isinstance(a, ParseLiteral):
+            self.compile_load_literal(a.value)
+        elif isinstance(a, ParseUnaryMessage):
+            self.compile_unary_message(a.recv, a.name, a.sup)
+        elif isinstance(a, ParseExecStatement):
+            self.compile_exec_statement(a.data)
+        else:
+            raise CompileError("bad message argument syntax "  + str(self._cur_meth))
+        
+    def compile_inline_message(self, recv, args):
+        """
+        Compile a conditional or loop message inline using
+        jump bytecodes.  Returns False if the message cannot
+        be inlined, in which case no code has been generated.
+        """
+        selName = "".join([a.name + ":" for a in args])
+        
+        # counted loops need a literal block as the last
+        # argument and a literal number as the step
+        if selName in self._Inline_Loop:
+            body = self.literal_block(args[-1].value, 0 if selName == "timesRepeat:" else 1)
+            if body is None:
+                return False
+            if selName == "timesRepeat:":
+                self.compile_inline_loop(None, recv, 1, body, False)
+            elif selName == "to:do:":
+                self.compile_inline_loop(recv, args[0].value, 1, body, True)
+            else:
+                step = self.literal_integer(args[1].value)
+                if not step:
+                    return False
+                self.compile_inline_loop(recv, args[0].value, step, body, False)
+            return True
+            
+        # all arguments must be literal blocks without arguments
+        if selName not in self._Inline_Keyword:
+            return False
+        blkList = [self.literal_block(a.value, 0) for a in args]
+        if None in blkList:
+            return False
+            
+        # loops also need a literal block receiver
+        if selName in ("whileTrue:", "whileFalse:"):
+            cond = self.literal_block(recv, 0)
+            if cond is None:
+                return False
+            self.compile_inline_while(cond, blkList[0], selName == "whileTrue:")
+            return True
+            
+        # conditionals test the receiver value
+        self.compile_exec_statement(recv.data)
+        if selName == "ifTrue:":
+            self.compile_inline_cond(B_POP_JUMP_FALSE, blkList[0], "nil")
+        elif selName == "ifFalse:":
+            self.compile_inline_cond(B_POP_JUMP_TRUE, blkList[0], "nil")
+        elif selName == "ifTrue:ifFalse:":
+            self.compile_inline_cond(B_POP_JUMP_FALSE, blkList[0], blkList[1])
+        elif selName == "ifFalse:ifTrue:":
+            self.compile_inline_cond(B_POP_JUMP_TRUE, blkList[0], blkList[1])
+        elif selName == "and:":
+            self.compile_inline_cond(B_POP_JUMP_FALSE, blkList[0], "false")
+        else:
+            self.compile_inline_cond(B_POP_JUMP_TRUE, blkList[0], "true")
+        return True
+        
+    def compile_inline_cond(self, jumpOp, first, second):
+        """
+        Compile the branches of an inlined conditional.  The
+        condition value must already be on the stack.  The first
+        block runs when the jump is not taken, otherwise second
+        runs, which is either a literal block or the name of a
+        constant to push.
+        """
+        depth = self._cur_depth - 1
+        skip = self.emit_jump(-1, jumpOp)
+        self.compile_inline_block(first)
+        done = self.emit_jump(0, B_JUMP)
+        self.patch_jump(skip)
+        self._cur_depth = depth
+        if isinstance(second, ParseLiteralBlock):
+            self.compile_inline_block(second)
+        else:
+            self.compile_load_literal(second)
+        self.patch_jump(done)
+        
+    def compile_inline_while(self, cond, body, whileTrue):
+        """
+        Compile an inlined whileTrue: or whileFalse: loop.  The
+        body may be None for the unary forms.  The loop value is nil.
+        """
+        top = len(self._cur_bytes)
+        self.compile_inline_block(cond)
+        if whileTrue:
+            done = self.emit_jump(-1, B_POP_JUMP_FALSE)
+        else:
+            done = self.emit_jump(-1, B_POP_JUMP_TRUE)
+        if body is not None:
+            self.compile_inline_block(body)
+            self.emit_bytes(-1, B_POP_STACK_TOP, 0)
+        self.emit_jump_back(top)
+        self.patch_jump(done)
+        self.compile_load_literal("nil")
+        
+    def compile_inline_loop(self, start, stop, step, body, keepStart):
+        """
+        Compile an inlined to:do:, to:by:do: or timesRepeat: loop.
+        The loop counter and the limit are kept in hidden temporaries
+        of the current context.  A start of None counts from 1, as
+        timesRepeat: does.  The loop value is the start value if
+        keepStart is True, otherwise the limit.
+        """
+        # allocate the counter and limit slots
+        counter = len(self._cur_local)
+        limit = counter + 1
+        self._cur_local.extend((None, None))
+        
+        # evaluate the start and the limit once
+        if start is None:
+            self.compile_load_literal(1)
+        else:
+            self.compile_arg_value(start)
+        if keepStart:
+            self.emit_bytes(1, B_DUP_STACK_TOP, 0)
+        self.emit_bytes(-1, B_STORE_TEMPORARY_VARIABLE, counter)
+        self.compile_arg_value(stop)
+        if not keepStart:
+            self.emit_bytes(1, B_DUP_STACK_TOP, 0)
+        self.emit_bytes(-1, B_STORE_TEMPORARY_VARIABLE, limit)
+            
+        # test the counter against the limit,
+        # the direction depends on the sign of the step
+        top = len(self._cur_bytes)
+        self.emit_bytes(1, B_PUSH_TEMPORARY_VARIABLE, counter)
+        self.emit_bytes(1, B_PUSH_TEMPORARY_VARIABLE, limit)
+        if step > 0:
+            self.emit_bytes(-1, B_LESS_EQUAL_SPECIAL, 1)
+        else:
+            self.emit_bytes(-1, B_GREATER_EQUAL_SPECIAL, 1)
+        done = self.emit_jump(-1, B_POP_JUMP_FALSE)
+        
+        # the block argument names the counter in the body
+        if body.args:
+            self._cur_local[counter] = body.args[0]
+        self.compile_inline_block(body)
+        self.emit_bytes(-1, B_POP_STACK_TOP, 0)
+        self._cur_local[counter] = None
+        
+        # advance the counter
+        self.emit_bytes(1, B_PUSH_TEMPORARY_VARIABLE, counter)
+        self.compile_load_literal(step)
+        self.emit_bytes(-1, B_PLUS_SPECIAL, 1)
+        self.emit_bytes(-1, B_STORE_TEMPORARY_VARIABLE, counter)
+        self.emit_jump_back(top)
+        self.patch_jump(done)
+        
+    def compile_inline_block(self, blk):
+        """
+        Compile the statements of a literal block in the current
+        context, leaving the value of the last statement on the stack.
+        """
+        # the block temporaries are allocated in the current context
+        # and cleared each time the block body is entered
+        base = len(self._cur_local)
+        self._cur_local.extend(blk.temps)
+        for idx in range(base, len(self._cur_local)):
+            self.compile_load_literal("nil")
+            self.emit_bytes(-1, B_STORE_TEMPORARY_VARIABLE, idx)
+        
+        # compile each statement
+        # skip empty statements
+        slist = [s for s in blk.value.data if s.data is not None]
+        if not slist:
+            self.compile_load_literal("nil")
+        for s in slist:
+            isLast = s is slist[-1]
+            self.compile_statement(s, isLast)
+            if isinstance(s, ParseReturnStatement):
+                # keep the stack depth consistent even though
+                # control does not continue past a return
+                self._cur_depth += 1
+            elif (not isLast) and (not isinstance(s, ParseAssignStatement)):
+                self.emit_bytes(-1, B_POP_STACK_TOP, 0)
+                
+        # hide the block temporaries but keep their slots
+        for idx in range(base, len(self._cur_local)):
+            self._cur_local[idx] = None
+            
+    @classmethod
+    def literal_block(klass, x, numArgs):
+        """
+        Return the ParseLiteralBlock if the parse node is a literal
+        block with the given number of arguments that can be compiled
+        inline, None otherwise.  Blocks whose variables could be
+        captured by a nested block are not inlined, since every
+        evaluation of an inlined block shares the same variables.
+        """
+        while isinstance(x, ParseExecStatement):
+            x = x.data
+        if isinstance(x, ParseLiteral) and isinstance(x.value, ParseLiteralBlock):
+            blk = x.value
+            if len(blk.args) == numArgs:
+                if not (blk.args or blk.temps) or not klass.contains_block(blk.value):
+                    return blk
+        return None
+        
+    @classmethod
+    def literal_integer(klass, x):
+        """
+        Return the value if the parse node is a literal
+        SmallInteger, None otherwise.
+        """
+        global Int_Max
+        while isinstance(x, ParseExecStatement):
+            x = x.data
+        if isinstance(x, ParseLiteral) and isinstance(x.value, int):
+            if abs(x.value) <= Int_Max:
+                return x.value
+        return None
+        
+    @classmethod
+    def contains_block(klass, x):
+        """
+        Return True if the parse tree contains a literal block
+        """
+        if isinstance(x, ParseLiteralBlock):
+            return True
+        if isinstance(x, list):
+            return any([klass.contains_block(y) for y in x])
+        if hasattr(x, "__dict__"):
+            return any([klass.contains_block(y) for y in vars(x).values()])
+        return False
+        
     def compile_cas_message(self, recv, mlist, isSuper):
         """
         Compile a cascade list of messages
@@ -894,7 +1150,9 @@ class Compile(object):
         
         # create new block object and its literals array
         blkObj = CompiledBlock()
-        blkObj.set_hdr(len(args), len(temps), self._max_depth)
+        blkObj.set_hdr(len(args), len(self._cur_local) - len(args), 
+                       self._max_depth, self._blk_flags[-1])
+        self.fuse_code(self._cur_bytes)
         blkObj.set_code(self._cur_bytes)
         if len(self._cur_literal):
             blkObj.literals = Array.from_seq(self._cur_literal)
@@ -916,9 +1174,14 @@ class Compile(object):
             self._sys.dis_bytecode(blkObj.get_code())
         
         # restore context state
-        self.context_pop()
+        flags = self.context_pop()
         
-        # add new block to context literals
+        # add new block to context literals, a clean block
+        # needs no state from the context creating it, so
+        # its closure is built once here and shared
+        if flags == CompiledBlock.CLEAN:
+            blkObj = BlockClosure(self._nil(), blkObj, self._nil())
+            blkObj.make_readonly()
         idx = self.add_literal(blkObj)
         self.emit_bytes(1, B_PUSH_LIT_CONSTANT, idx)
         
@@ -994,6 +1257,7 @@ class Compile(object):
         self._cur_literal = []
         self._cur_local = []
         self._cur_depth = self._max_depth = 0
+        self._blk_flags.append(CompiledBlock.CLEAN)
         
     def context_pop(self):
         """
@@ -1004,6 +1268,7 @@ class Compile(object):
         self._cur_depth, \
         self._max_depth, \
         self._cur_local  = self._ctx_stack.pop()
+        return self._blk_flags.pop()
         
     def add_literal(self, x):
         """
@@ -1024,6 +1289,69 @@ class Compile(object):
         self._cur_depth += stackInc
         self._max_depth = max(self._max_depth, self._cur_depth)
         self._cur_bytes.extend((bc))
+        if self._blk_flags:
+            self.mark_blocks(bc)
+        
+    def mark_blocks(self, bc):
+        """
+        Update the clean-ness flags of the blocks being compiled
+        for bytecodes that need state from the block closure.
+        Blocks enclosing the current one need that state too
+        in order to pass it on to the nested block closure.
+        """
+        for n in range(0, len(bc), 2):
+            op = bc[n]
+            # class variables are found through the receiver
+            if (op == B_PUSH_SELF) or \
+               (op == B_PUSH_RECEIVER_VARIABLE) or \
+               (op == B_STORE_RECEIVER_VARIABLE) or \
+               (op == B_PUSH_LIT_VARIABLE) or \
+               (op == B_STORE_LIT_VARIABLE):
+                self.mark_outer(len(self._blk_flags), CompiledBlock.SELF)
+            elif (op == B_PUSH_OUTER_TEMP) or (op == B_STORE_OUTER_TEMP):
+                self.mark_outer(bc[n + 3] + 1, bc[n + 3] + 2)
+            elif (op == B_RETURN_METHOD_STACK_TOP) or (op == B_PUSH_SPECIAL):
+                self.mark_outer(len(self._blk_flags), CompiledBlock.FULL)
+                
+    def mark_outer(self, levels, flags):
+        """
+        Raise the clean-ness flags of the current block and the
+        blocks enclosing it up to levels out.  Each enclosing
+        block reaches one context less than the one inside it.
+        """
+        blkFlags = self._blk_flags
+        for n in range(1, levels + 1):
+            blkFlags[-n] = max(blkFlags[-n], flags)
+            if (flags > CompiledBlock.SELF) and (flags < CompiledBlock.FULL):
+                flags -= 1
+        
+    def emit_jump(self, stackInc, op):
+        """
+        Append a forward jump bytecode with the offset left to
+        be filled in by patch_jump.  Returns the position of the jump.
+        """
+        pos = len(self._cur_bytes)
+        self.emit_bytes(stackInc, op, 0, B_EXT_BYTE, 0)
+        return pos
+        
+    def patch_jump(self, pos):
+        """
+        Set the target of a forward jump to the current position
+        """
+        offset = len(self._cur_bytes) - (pos + 4)
+        if offset > 0xffff:
+            raise CompileError("jump too far " + str(self._cur_meth))
+        self._cur_bytes[pos + 1] = offset & 0xff
+        self._cur_bytes[pos + 3] = offset >> 8
+        
+    def emit_jump_back(self, target):
+        """
+        Append a backward jump bytecode to the target position
+        """
+        offset = len(self._cur_bytes) + 4 - target
+        if offset > 0xffff:
+            raise CompileError("jump too far " + str(self._cur_meth))
+        self.emit_bytes(0, B_JUMP_BACK, offset & 0xff, B_EXT_BYTE, offset >> 8)
         
     def find_local(self, name):
         """
@@ -1036,10 +1364,12 @@ class Compile(object):
         scope = 0
         
         # look in this context
-        try:
-            return (self._cur_local.index(name), scope)
-        except ValueError:
-            pass
+        # search from the end so temporaries of inlined
+        # blocks hide any earlier declaration
+        varList = self._cur_local
+        for idx in range(len(varList) - 1, -1, -1):
+            if varList[idx] == name:
+                return (idx, scope)
             
         # look in parent contexts
         varStack = []
@@ -1055,11 +1385,19 @@ class Compile(object):
         # name is not local
         return (None, scope)
 
+    # superinstructions in the order they are tried,
+    # sends first since they save the most work
+    _Super_Order = (B_SEND_UNARY_LIT, B_PUSH_TEMPS_SPECIAL,
+                    B_PUSH_SELF_PUSH_LIT, B_PUSH_TEMP_PUSH_LIT, B_PUSH_LIT_PUSH_TEMP,
+                    B_PUSH_TEMP_PUSH_TEMP, B_STORE_TEMP_PUSH_TEMP,
+                    B_POP_PUSH_SELF, B_POP_PUSH_TEMP)
+    
     def optimize(self, methObj):
         """
         Optimize a compiled method
         """
         code = methObj.get_code()
+        self.flag_quick(methObj)
         
         # consolidate code buffers for all ^self messages
         if (code is not self._Ret_Self_Bytes) and (len(code) == 4) and \
@@ -1073,7 +1411,78 @@ class Compile(object):
             methObj.set_code(self._Ret_Lit0_Bytes)
             return methObj
             
+        self.fuse_code(code)
         return methObj
+        
+    def flag_quick(self, methObj):
+        """
+        Flag trivial methods in the method so they
+        can be run without a context: ^self, ^instVar, ^arg,
+        ^literal, ^integer and instVar := arg. ^self
+        """
+        code = methObj.get_code()
+        numArg, numTemp, depth, primId = methObj.get_hdr()
+        if primId:
+            return
+        if (len(code) == 4) and (code[2] == B_RETURN_METHOD_STACK_TOP):
+            op, arg = code[0], code[1]
+            if op == B_PUSH_SELF:
+                methObj.set_quick(Q_RETURN_SELF, 0)
+            elif op == B_PUSH_RECEIVER_VARIABLE:
+                methObj.set_quick(Q_RETURN_INST_VAR, arg)
+            elif op == B_PUSH_INTEGER:
+                methObj.set_quick(Q_RETURN_INTEGER, arg)
+            elif (op == B_PUSH_TEMPORARY_VARIABLE) and (arg < numArg):
+                methObj.set_quick(Q_RETURN_ARG, arg)
+            elif (op == B_PUSH_LIT_CONSTANT) and \
+                    not isinstance(methObj.literals[arg], CompiledBlock):
+                methObj.set_quick(Q_RETURN_LITERAL, arg)
+        elif (len(code) == 8) and (numArg == 1) and \
+                (code[0] == B_PUSH_TEMPORARY_VARIABLE) and (code[1] == 0) and \
+                (code[2] == B_STORE_RECEIVER_VARIABLE) and \
+                (code[4] == B_PUSH_SELF) and (code[6] == B_RETURN_METHOD_STACK_TOP):
+            methObj.set_quick(Q_SET_INST_VAR, code[3])
+        
+    def fuse_code(self, code):
+        """
+        Replace common instruction sequences with superinstructions.
+        Only the opcode of the first instruction is changed, so the
+        code can still be entered at any of the fused instructions.
+        """
+        # instruction offsets, skipping 4 byte instructions
+        insList = []
+        ip = 0
+        while ip < len(code) - 1:
+            if (ip + 3 < len(code)) and (code[ip + 2] == B_EXT_BYTE):
+                ip += 4
+            else:
+                insList.append(ip)
+                ip += 2
+                
+        # fuse runs of adjacent instructions
+        used = set()
+        for op in self._Super_Order:
+            seq = B_SUPER[op]
+            for n in range(len(insList) - len(seq) + 1):
+                ipList = insList[n : n + len(seq)]
+                if (ipList[-1] - ipList[0] != 2 * (len(seq) - 1)) or used.intersection(ipList):
+                    continue
+                if not all([self.fuse_match(code, ip, x) for ip, x in zip(ipList, seq)]):
+                    continue
+                if (op == B_SEND_UNARY_LIT) and (code[ipList[1] + 1] != 0):
+                    continue
+                code[ipList[0]] = op
+                used.update(ipList)
+                
+    @staticmethod
+    def fuse_match(code, ip, op):
+        """
+        Return True if the instruction at ip matches an
+        opcode from a superinstruction sequence
+        """
+        if op is None:
+            return code[ip] <= B_SAME_OBJECT_SPECIAL
+        return code[ip] == op
             
 
         
\ No newline at end of file
@@ -116,7 +116,7 @@ Init_Class = (
     ("WeakKeyDictionary", False, "weak_key_dict", "dictionary", False, ("keys",), (), ()),
     ("WeakKeyIdentityDictionary", False, "weak_key_ident_dict", "weak_key_dict", False, (), (), ()),
     ("SymbolTableArray", True, "symbol_table", "array", False, (), (), ()),
-    ("ObjectMemory", False, "object_memory", "object", True, ("numObject", "numMethodSlab", "numMethodAlloc", "numBlockSlab", "numBlockAlloc", "numPyBlock"), (), ()),
+    ("ObjectMemory", False, "object_memory", "object", True, ("numObject", "numMethodSlab", "numMethodAlloc", "numBlockSlab", "numBlockAlloc", "numPyBlock", "poolLimit", "numMethodDrop", "numBlockDrop"), (), ()),
     ("TestSuite", False, "test", "object", True, ("testInst1", "testInst2"), ("TestClassVar",), ()),
 )
 
@@ -277,6 +277,7 @@ Init_Primitive = (
     "Behavior_basicNewColon",
     "Behavior_newInitialize",
     "Behavior_newColonInitialize",
+    "Behavior_flushCache",
     "Character_create",
     "Character_equal",
     "SmallInteger_plus",
@@ -414,4 +415,5 @@ Init_Primitive = (
     "FileDescriptor_fileOp",
     "ObjectMemory_update",
     "ObjectMemory_snapshot",
+    "ObjectMemory_compact",
 )
@@ -3,12 +3,72 @@ Bytecode interpreter
 """
 
 from st import *
+from translate import Translate
 import math
 import stat
 import time
 import datetime
 
 
+class CodeCache(object):
+    """
+    Interpreter state derived from a CompiledMethod or CompiledBlock,
+    kept in the code object's _py_cache.  It is rebuilt on demand and
+    never saved in the image.
+    """
+    
+    __slots__ = ("sites", "thread", "count")
+    
+    def __init__(self):
+        """
+        Create an empty code cache
+        """
+        self.sites  = {}
+        self.thread = None
+        self.count  = 0
+        
+        
+class SendSite(object):
+    """
+    Inline cache for a single send bytecode
+    """
+    
+    # number of receiver classes remembered before
+    # the site is considered megamorphic
+    _Max_Poly = 4
+    
+    __slots__ = ("selector", "epoch", "klasses", "methods", "mega", "hits", "misses")
+    
+    def __init__(self, selObj, epoch):
+        """
+        Create an empty site cache
+        """
+        self.selector   = selObj
+        self.epoch      = epoch
+        self.klasses    = []
+        self.methods    = []
+        self.mega       = False
+        self.hits       = 0
+        self.misses     = 0
+        
+        
+class NewTemplate(object):
+    """
+    Allocation template for instances of a fixed size class,
+    kept in the Class object.  The template is rebuilt when
+    the class instanceSpec changes.
+    """
+    
+    __slots__ = ("spec", "refs")
+    
+    def __init__(self, spec, refs):
+        """
+        Create a template for the instance spec
+        """
+        self.spec   = spec
+        self.refs   = refs
+        
+        
 class Interp(object):
     """
     Interpreter definition
@@ -49,9 +109,11 @@ class Interp(object):
         
         # get refs to special selector symbols
         self._sel_initialize    = self._make_sel("initialize")
-        self._sel_mourn_colon   = self._make_sel("mourn:")
         self._sel_mourn         = self._make_sel("mourn")
+        self._sel_bad_return    = self._make_sel("badReturnError")
+        self._sel_dead_return   = self._make_sel("returnFromDeadMethod")
         self._sel_no_know       = self._make_sel("doesNotUnderstand:")
+        self._sel_must_be_bool  = self._make_sel("mustBeBoolean")
         self._sel_value         = self._make_sel("value")
         self._sel_size          = self._make_sel("size")
         self._sel_isnil         = self._make_sel("isNil")
@@ -94,10 +156,34 @@ class Interp(object):
         self.i_alloc_blk    = 0
         self.i_alloc_mth    = 0
         
+        # free contexts above the pool limit are left to the
+        # garbage collector, so a deep recursion does not keep
+        # its contexts forever
+        self.i_pool_limit   = 4096
+        self.i_drop_blk     = 0
+        self.i_drop_mth     = 0
+        
+        # global method lookup cache
+        # maps (class, selector) to method
+        self.i_meth_cache   = {}
+        
+        # inline caches older than this are stale
+        self.i_meth_epoch   = 0
+        
         # cached empty method
         self._nil_method            = CompiledMethod()
         self._nil_method.descriptor = MethodInfo(self._nil())
         
+        # methods run by contexts the interpreter starts by
+        # itself, they are created on first use
+        self._init_method   = None
+        self._mourn_method  = None
+        self._bad_return_method = None
+        
+        # mourn messages waiting for the interpreter
+        # to reach a safe point, these are the weak owners
+        self.i_mourn        = []
+        
         # file operations handler table
         self.i_fileop = fTbl = [self._file_undef] * 20
         fTbl[self.FILE_OPEN_FILE]       = self.f_open
@@ -113,8 +199,18 @@ class Interp(object):
         fTbl[self.FILE_ASYNC_POLL]      = self.f_poll
         
         # debugging support
+        # the debug hooks are only called by the debug run loop
         self.i_debug_pre    = self._debug_default
         self.i_debug_post   = self._debug_default
+        self.i_debugging    = False
+        self.i_break_hook   = None
+        
+        # execute threaded code instead of
+        # decoding each bytecode
+        self.i_threaded     = True
+        
+        # translation of hot code into Python
+        self.i_translate    = Translate(system)
         
         # the bytecode handler table
         self.b_table = bTbl = [self._op_undef] * 256
@@ -134,6 +230,10 @@ class Interp(object):
         bTbl[B_STORE_RECEIVER_VARIABLE]     = self.b_store_recv_var
         bTbl[B_RETURN_METHOD_STACK_TOP]     = self.b_meth_ret
         bTbl[B_RETURN_CONTEXT_STACK_TOP]    = self.b_blk_ret
+        bTbl[B_JUMP]                        = self.b_jump
+        bTbl[B_JUMP_BACK]                   = self.b_jump_back
+        bTbl[B_POP_JUMP_TRUE]               = self.b_pop_jump_true
+        bTbl[B_POP_JUMP_FALSE]              = self.b_pop_jump_false
         bTbl[B_SEND]                        = self.b_send
         bTbl[B_SEND_SUPER]                  = self.b_send_super
         bTbl[B_VALUE_SPECIAL]               = self.b_send_spec_value
@@ -161,6 +261,23 @@ class Interp(object):
         bTbl[B_BIT_OR_SPECIAL]              = self.b_send_spec_bit_or
         bTbl[B_BIT_XOR_SPECIAL]             = self.b_send_spec_bit_xor
         bTbl[B_BIT_SHIFT_SPECIAL]           = self.b_send_spec_bit_shift
+        bTbl[B_SEND_UNARY_LIT]              = self.b_send_unary_lit
+        bTbl[B_PUSH_SELF_PUSH_LIT]          = self.b_push_self_push_lit
+        bTbl[B_PUSH_TEMP_PUSH_LIT]          = self.b_push_temp_push_lit
+        bTbl[B_PUSH_LIT_PUSH_TEMP]          = self.b_push_lit_push_temp
+        bTbl[B_PUSH_TEMP_PUSH_TEMP]         = self.b_push_temp_push_temp
+        bTbl[B_STORE_TEMP_PUSH_TEMP]        = self.b_store_temp_push_temp
+        bTbl[B_POP_PUSH_SELF]               = self.b_pop_push_self
+        bTbl[B_POP_PUSH_TEMP]               = self.b_pop_push_temp
+        bTbl[B_PUSH_TEMPS_SPECIAL]          = self.b_push_temps_special
+        bTbl[B_EXIT_INTERPRETER]            = self.b_exit_interp
+        
+        # threaded code handlers for bytecodes with
+        # an extension byte, which is decoded once
+        self.t_table = {
+            B_PUSH_OUTER_TEMP   : self.t_push_outer_var,
+            B_STORE_OUTER_TEMP  : self.t_store_outer_var,
+        }
         
     def _debug_default(self):
         """
@@ -223,39 +340,6 @@ class Interp(object):
         self.i_context = self._nil()
         return ret
         
-    def send_message_intern(self, recvObj, selObj, argValues):
-        """
-        Send a message from inside the interpreter.
-        The selector name is a python str and the arg
-        value sequence must match the selector arg order.
-        """
-        # save the root context
-        ctxSave = self.i_context
-        
-        # create the root context
-        # leave the parent and receiver nil
-        self.i_context = ctx = self._alloc_root_context()
-        
-        # push receiver and args onto current stack
-        ctx.push(recvObj)
-        for arg in argValues:
-            ctx.push(arg)
-            
-        # send message and run until control
-        # returns to this root context
-        self.send_message(len(argValues), False, selObj)
-        self.exec()
-        
-        # pop return value from stack
-        ret = ctx.pop()
-        
-        # free root context
-        self.free_mth_context(ctx)
-        
-        # restore context and return value
-        self.i_context = ctxSave
-        return ret
-        
     def _alloc_root_context(self):
         """
         Create a root MethodContext
@@ -289,61 +373,50 @@ class Interp(object):
         self.i_context = self._nil()
         return ret
         
-    def send_message(self, numArgs, isSuper, selObj):
+    def send_message(self, numArgs, isSuper, selObj, site = -1):
         """
         Send a message.  This assumes that the receiver,
         message selector (possibly), and argument values have been
-        pushed to the current stack.
+        pushed to the current stack.  Sends made by a bytecode pass
+        the bytecode offset of the call site so the lookup can use
+        the site's inline cache.
         """
         # get old context
         oldCtx = self.i_context
         
-        # pop the message arguments from parent stack
-        if numArgs:
-            argList = [None] * numArgs
-            n = numArgs
-            while n:
-                argList[n - 1] = oldCtx.pop()
-                n -= 1
-        else:
-            argList = ()
-        
-        # pop the message selector and receiver
+        # take the message arguments from the parent stack
+        # as a single slice, then drop them along with the
+        # message selector and receiver
+        refs = oldCtx._refs
+        top = len(refs)
+        argList = refs[top - numArgs:]
+        n = numArgs + 1
         if selObj is None:
-            selObj = oldCtx.pop()
-        recvObj = oldCtx.pop()
+            n += 1
+            selObj = refs[top - numArgs - 1]
+        if top < n:
+            raise SmalltalkException("stack underflow")
+        recvObj = refs[top - n]
+        del refs[top - n:]
     
         # get class type for receiver
         # handle primitive types specially
-        # start one class up in hierarchy if send super
-        origKlass = klassObj = self._obj_class(recvObj)
-        if isSuper:
-            klassObj = klassObj.superClass
+        klassObj = self._obj_class(recvObj)
             
         # lookup method object from selector symbol
-        # search from receiver's class through its
-        # superclasses until Object's nil superclass
-        # if send super, skip the current method if encountered
-        methObj = self._nil()
-        while not klassObj.is_nil():
-            #print("meth lookup", klassObj)
-            methDict = klassObj.methodDictionary
-            if not methDict.is_nil():
-                methObj = self._sys.identdict_find(methDict, selObj)
-                if not methObj.is_nil():
-                    if isSuper:
-                        if not oldCtx.method.is_same(methObj):
-                            break
-                        isSuper = False
-                    else:
-                        break
-            klassObj = klassObj.superClass 
+        # start one class up in hierarchy if send super
+        if isSuper:
+            methObj = self.lookup_super(klassObj.superClass, selObj, oldCtx.method)
+        elif site < 0:
+            methObj = self.lookup_method(klassObj, selObj)
+        else:
+            methObj = self.lookup_site(oldCtx.method, site, klassObj, selObj)
             
         # if message is not found send doesNotUnderstand: to object
         if methObj.is_nil():
-            methObj = self._does_not_understand(origKlass)
+            methObj = self._does_not_understand(klassObj)
             numArgs = 1
-            argList = (Message(selObj, Array.from_seq(argList)),)
+            argList = [Message(selObj, Array.from_seq(argList))]
 
         # get method info
         numHdrArgs, numTemp, depth, primId = methObj.get_hdr()
@@ -357,6 +430,13 @@ class Interp(object):
         # the primitive op is successful
         if primId and self.i_primitive[primId](oldCtx, recvObj, argList):
             return
+            
+        # trivial methods return their result
+        # to the sender without a new context
+        quick = methObj.get_quick()
+        if quick:
+            oldCtx.push(self.quick_method(methObj, quick, recvObj, argList))
+            return
         
         # allocate a new context and link to old
         newCtx          = self.alloc_mth_context()
@@ -364,31 +444,201 @@ class Interp(object):
         newCtx.receiver = recvObj
         newCtx.method   = methObj
         
-        # push args onto new stack
-        for arg in argList:
-            newCtx.push(arg)
-            
-        # make room for temp variables on new stack
-        if numTemp:
-            newCtx.expand(numTemp)
+        # the argument slice becomes the new stack
+        # with room for temp variables
+        newCtx.take_args(argList, numTemp)
         
         # transfer control to new context
         self.i_context = newCtx
         
-    def _does_not_understand(self, klass):
+    def quick_method(self, methObj, quick, recvObj, argList):
+        """
+        Run a trivial method flagged by the compiler and
+        return its result
+        """
+        kind = quick & 0x7
+        index = quick >> 3
+        if kind == Q_RETURN_INST_VAR:
+            return recvObj[index]
+        if kind == Q_RETURN_LITERAL:
+            return methObj.literals[index]
+        if kind == Q_SET_INST_VAR:
+            recvObj[index] = argList[0]
+        elif kind == Q_RETURN_INTEGER:
+            return index
+        elif kind == Q_RETURN_ARG:
+            return argList[index]
+        return recvObj
+        
+    def lookup_method(self, klassObj, selObj):
+        """
+        Find the method for a selector, searching from the class
+        through its superclasses until Object's nil superclass.
+        Returns nil if the selector is not understood.  Results
+        are kept in the global method cache.
+        """
+        key = (klassObj, selObj)
+        try:
+            return self.i_meth_cache[key]
+        except KeyError:
+            pass
+        methObj = self._nil()
+        while not klassObj.is_nil():
+            #print("meth lookup", klassObj)
+            methDict = klassObj.methodDictionary
+            if not methDict.is_nil():
+                methObj = self._sys.identdict_find(methDict, selObj)
+                if not methObj.is_nil():
+                    break
+            klassObj = klassObj.superClass
+        self.i_meth_cache[key] = methObj
+        return methObj
+        
+    def lookup_super(self, klassObj, selObj, curMeth):
         """
-        Lookup doesNotUnderstand: selector because of unknown message
+        Find the method for a send super, skipping the currently
+        executing method if it is encountered.  Results are kept
+        in the global method cache.
         """
+        key = (klassObj, selObj, curMeth)
+        try:
+            return self.i_meth_cache[key]
+        except KeyError:
+            pass
         methObj = self._nil()
-        selObj = self._sel_no_know()
-        while not klass.is_nil():
+        skip = True
+        while not klassObj.is_nil():
             #print("meth lookup", klassObj)
-            methDict = klass.methodDictionary
+            methDict = klassObj.methodDictionary
             if not methDict.is_nil():
                 methObj = self._sys.identdict_find(methDict, selObj)
                 if not methObj.is_nil():
-                    break
-            klass = klass.superClass
+                    if not (skip and curMeth.is_same(methObj)):
+                        break
+                    skip = False
+            klassObj = klassObj.superClass
+        self.i_meth_cache[key] = methObj
+        return methObj
+        
+    def lookup_site(self, codeObj, site, klassObj, selObj):
+        """
+        Find the method for a send bytecode using the inline cache
+        for the call site.  Sites remember up to SendSite._Max_Poly
+        receiver classes, after which they become megamorphic and
+        fall back to the global method cache.
+        """
+        # get the site cache, discarding it if stale
+        codeCache = self.code_cache(codeObj)
+        entry = codeCache.sites.get(site)
+        if (entry is None) or (entry.epoch != self.i_meth_epoch):
+            codeCache.sites[site] = entry = SendSite(selObj, self.i_meth_epoch)
+        
+        # monomorphic fast path
+        klasses = entry.klasses
+        if klasses and (klasses[0] is klassObj):
+            entry.hits += 1
+            return entry.methods[0]
+            
+        # search polymorphic entries
+        for n,k in enumerate(klasses):
+            if k is klassObj:
+                entry.hits += 1
+                return entry.methods[n]
+                
+        # miss, do a full lookup and remember the result
+        entry.misses += 1
+        methObj = self.lookup_method(klassObj, selObj)
+        if not entry.mega:
+            if len(klasses) < SendSite._Max_Poly:
+                klasses.append(klassObj)
+                entry.methods.append(methObj)
+            else:
+                entry.mega = True
+                klasses.clear()
+                entry.methods.clear()
+        return methObj
+        
+    def code_cache(self, codeObj):
+        """
+        Return the CodeCache for a CompiledMethod or CompiledBlock,
+        creating it if needed.
+        """
+        codeCache = codeObj._py_cache
+        if codeCache is None:
+            codeObj._py_cache = codeCache = CodeCache()
+        return codeCache
+        
+    def thread_code(self, codeObj):
+        """
+        Return the threaded code for a CompiledMethod or CompiledBlock.
+        This is a list indexed by instruction pointer holding the
+        (handler, arg) pair for the bytecode at that offset, built
+        the first time the code is executed.
+        """
+        codeCache = self.code_cache(codeObj)
+        thread = codeCache.thread
+        if thread is None:
+            code = codeObj.get_code()
+            bTbl = self.b_table
+            tTbl = self.t_table
+            thread = [None] * len(code)
+            for ip in range(0, len(code) - 1, 2):
+                op = code[ip]
+                if op in tTbl:
+                    # decode the scope level from the extension
+                    thread[ip] = (tTbl[op], (code[ip + 1], code[ip + 3]))
+                else:
+                    thread[ip] = (bTbl[op], code[ip + 1])
+            codeCache.thread = thread
+        return thread
+        
+    def enter_code(self, codeObj):
+        """
+        Return the threaded code for a CompiledMethod or CompiledBlock
+        which is being activated.
+        """
+        thread = self.thread_code(codeObj)
+        self.heat_code(codeObj)
+        return thread
+        
+    def heat_code(self, codeObj):
+        """
+        Count an activation or loop iteration of threaded code.
+        Hot code is translated into Python functions, which are
+        installed in its threaded code in place.
+        """
+        codeCache = codeObj._py_cache
+        if (codeCache is not None) and (codeCache.thread is not None):
+            codeCache.count += 1
+            if codeCache.count == Translate._Hot_Count:
+                self.i_translate.translate(codeObj, codeCache.thread)
+        
+    def get_send_sites(self):
+        """
+        Return a list of (code, site, SendSite) for every
+        send bytecode which has an inline cache.
+        """
+        siteList = []
+        for obj in Object.get_all_obj():
+            if isinstance(obj, (CompiledMethod, CompiledBlock)) and (obj._py_cache is not None):
+                for site, entry in sorted(obj._py_cache.sites.items()):
+                    siteList.append((obj, site, entry))
+        return siteList
+        
+    def flush_cache(self):
+        """
+        Invalidate the global method cache and all call site
+        inline caches.  This must be called whenever a method
+        dictionary or class hierarchy changes.
+        """
+        self.i_meth_cache.clear()
+        self.i_meth_epoch += 1
+        
+    def _does_not_understand(self, klass):
+        """
+        Lookup doesNotUnderstand: selector because of unknown message
+        """
+        methObj = self.lookup_method(klass, self._sel_no_know())
         if methObj.is_nil():
             raise SmalltalkException("doesNotUnderstand: not found")
         return methObj
@@ -408,9 +658,50 @@ class Interp(object):
     def set_debug(self, preHook, postHook):
         """
         Set callbacks to be invoked before and after every bytecode instruction.
+        Installing hooks other than the default switches execution to the
+        debug run loop at the next context change.
         """
         self.i_debug_pre    = preHook
         self.i_debug_post   = postHook
+        self.i_debugging    = (preHook != self._debug_default) or \
+                              (postHook != self._debug_default)
+        
+    def set_break(self, hook):
+        """
+        Set a callback invoked with each new MethodContext on method
+        entry, or remove it if hook is None.  The check is made by
+        shadowing send_message, so there is no cost when no
+        breakpoint is set.
+        """
+        self.i_break_hook = hook
+        if hook is None:
+            self.__dict__.pop("send_message", None)
+        else:
+            self.send_message = self._send_message_break
+            
+    def _send_message_break(self, numArgs, isSuper, selObj, site = -1):
+        """
+        Send a message and pass any new MethodContext to the
+        break hook.  Installed as send_message by set_break.
+        """
+        oldCtx = self.i_context
+        Interp.send_message(self, numArgs, isSuper, selObj, site)
+        newCtx = self.i_context
+        if (newCtx is not oldCtx) and isinstance(newCtx, MethodContext):
+            self.i_break_hook(newCtx)
+        
+    def set_threaded(self, threaded):
+        """
+        Select execution of threaded code or plain bytecodes
+        """
+        self.i_threaded = threaded
+        
+    def set_pool_limit(self, limit):
+        """
+        Set the number of free contexts kept in each
+        context pool
+        """
+        self.i_pool_limit = limit
         
     def get_debug(self):
         """
@@ -430,20 +721,59 @@ class Interp(object):
         self.i_primitive.append(handler)
         return True
         
-    def delete_object(self, obj):
+    def delete_object(self, weakOwners):
         """
-        Handle cleanup when an object is garbage collected
+        Handle cleanup when an object with weak owners
+        is garbage collected
         """
-        # look for weak references
-        # only Objects with weak references need to be finalized
-        if hasattr(obj, "_weak_obj"):
-            # send mourn: message to weak owners
-            for owner in copy(obj._weak_obj):
-                #print("MOURN: ", str(owner), str(obj))
-                if isinstance(owner, EphemObject):
-                    self.send_message_intern(owner, self._sel_mourn(), ())
-                else:
-                    self.send_message_intern(owner, self._sel_mourn_colon(), (obj,))
+        # queue mourn message to weak owners, the
+        # interpreter sends them at the next safe point
+        self.i_mourn.extend(weakOwners)
+        
+    def start_mourning(self):
+        """
+        Start a context for each queued mourn message.  The
+        contexts are above the current one and return to it
+        without a reply, so execution resumes where it was.
+        """
+        mournList = self.i_mourn
+        while mournList:
+            owner = mournList.pop()
+            methObj = self._mourn_method
+            if methObj is None:
+                methObj = self.make_method(self._sys.k_object(), self._sel_mourn(),
+                              (B_SEND, 0, B_POP_STACK_TOP, 0, B_EXIT_INTERPRETER, 0))
+                self._mourn_method = methObj
+            # the mourn context is the bottom of its own
+            # environment, unwinds and backtraces stop there
+            self.start_context(methObj, owner, (owner, self._sel_mourn()), 4)
+            
+    def start_context(self, methObj, recvObj, stack, flags = 0):
+        """
+        Start a context for a method the interpreter runs by
+        itself, above the current context and with its stack
+        already holding the values in stack.
+        """
+        newCtx          = self.alloc_mth_context()
+        newCtx.parent   = self.i_context
+        newCtx.receiver = recvObj
+        newCtx.method   = methObj
+        newCtx.flags    = flags
+        for x in stack:
+            newCtx.push(x)
+        self.i_context = newCtx
+        
+    def make_method(self, klassObj, selObj, code):
+        """
+        Create a method for contexts the interpreter starts
+        by itself.  It shows as klassObj>>selObj in backtraces.
+        """
+        methObj = CompiledMethod()
+        methObj.set_hdr(0, 0, 4, 0)
+        methObj.set_code(bytearray(code))
+        methObj.descriptor = MethodInfo(klassObj)
+        methObj.descriptor.selector = selObj
+        return methObj
                     
     def alloc_mth_context(self):
         """
@@ -462,16 +792,22 @@ class Interp(object):
     def free_mth_context(self, ctx):
         """
         Release an unused MethodContext. The MethodContext object
-        should not be referenced after this method returns.
+        should not be referenced after this method returns, unless
+        it escaped.
         """
-        # reset context state
-        ctx.resize(7)
-        ctx.flags   = 0
-        ctx.sp      = 6
-        ctx.ip      = 0
+        # an escaped context is left to the garbage
+        # collector, a nil parent marks it as returned
+        if ctx.is_escaped():
+            ctx.parent = self._nil()
+            return
             
-        # return to slab
-        self.i_slab_mth.append(ctx)
+        # return to slab unless it is full
+        slab = self.i_slab_mth
+        if len(slab) < self.i_pool_limit:
+            ctx.reset()
+            slab.append(ctx)
+        else:
+            self.i_drop_mth += 1
                     
     def alloc_blk_context(self):
         """
@@ -490,15 +826,22 @@ class Interp(object):
     def free_blk_context(self, ctx):
         """
         Release an unused BlockContext. The BlockContext object
-        should not be referenced after this method returns.
+        should not be referenced after this method returns, unless
+        it escaped.
         """
-        # reset context state
-        ctx.resize(7)
-        ctx.sp = 6
-        ctx.ip = 0
-        
-        # return to slab
-        self.i_slab_blk.append(ctx)
+        # an escaped context is left to the garbage
+        # collector, a nil parent marks it as returned
+        if ctx.is_escaped():
+            ctx.parent = self._nil()
+            return
+            
+        # return to slab unless it is full
+        slab = self.i_slab_blk
+        if len(slab) < self.i_pool_limit:
+            ctx.reset()
+            slab.append(ctx)
+        else:
+            self.i_drop_blk += 1
         
     def clear_slabs(self):
         """
@@ -511,11 +854,68 @@ class Interp(object):
         """
         Start executing bytecodes from current location
         until the control returns to the root context.
+        The run loop is chosen again whenever one of them
+        returns because debug hooks were installed or removed.
         """
         while not self.i_context.parent.is_nil():
+            if self.i_debugging:
+                self.exec_debug()
+            elif self.i_threaded:
+                self.exec_threaded()
+            else:
+                self.exec_bytecode()
+            
+    def exec_debug(self):
+        """
+        Execute bytecodes one at a time, calling the debug
+        hooks around each, until control returns to the root
+        context or the hooks are removed.
+        """
+        while (not self.i_context.parent.is_nil()) and self.i_debugging:
+            if self.i_mourn:
+                self.start_mourning()
             self.i_debug_pre()
             self.step()
             self.i_debug_post()
+            
+    def exec_bytecode(self):
+        """
+        Execute bytecodes from the current location until control
+        returns to the root context or debug hooks are installed.
+        The code is only fetched when the context changes.
+        """
+        bTbl = self.b_table
+        ctx = self.i_context
+        while not (ctx.parent.is_nil() or self.i_debugging):
+            if self.i_mourn:
+                self.start_mourning()
+                ctx = self.i_context
+            code = ctx.method.get_code()
+            while self.i_context is ctx:
+                ip = ctx.ip
+                bTbl[code[ip]](ctx, code[ip + 1])
+            ctx = self.i_context
+            
+    def exec_threaded(self):
+        """
+        Execute threaded code from the current location until
+        control returns to the root context or debug hooks are
+        installed.  The threaded code is only fetched when the
+        context changes.
+        """
+        ctx = self.i_context
+        while not (ctx.parent.is_nil() or self.i_debugging):
+            if self.i_mourn:
+                self.start_mourning()
+                ctx = self.i_context
+            if ctx.ip:
+                thread = self.thread_code(ctx.method)
+            else:
+                thread = self.enter_code(ctx.method)
+            while self.i_context is ctx:
+                handler, arg = thread[ctx.ip]
+                handler(ctx, arg)
+            ctx = self.i_context
         
     def step(self):
         """
@@ -539,15 +939,20 @@ class Interp(object):
         Execute the B_PUSH_LIT_CONSTANT bytecode.
         Push a method or block literal onto the stack.
         """
-        # look for compiled blocks
-        # turn into BlockClosures
-        lit = ctx.method.literals[arg]
+        ctx.push(self.lit_const(ctx, arg))
+        ctx.ip += 2
+        
+    def lit_const(self, ctx, index):
+        """
+        Return a method or block literal, turning
+        compiled blocks into BlockClosures
+        """
+        lit = ctx.method.literals[index]
         if is_obj(lit) and (lit.get_class() is self._sys.k_comp_block()):
+            # the closure keeps the context after it returns
+            ctx.make_escaped()
             lit = BlockClosure(ctx, lit, ctx.receiver)
-            
-        # return on stack
-        ctx.push(lit)
-        ctx.ip += 2
+        return lit
         
     def b_push_lit_var(self, ctx, arg):
         """
@@ -588,7 +993,7 @@ class Interp(object):
         Execute the B_PUSH_TEMPORARY_VARIABLE bytecode.
         Push a method or block temporary variable onto the stack.
         """
-        ctx.push(ctx[7 + arg])
+        ctx.push(ctx._refs[arg])
         ctx.ip += 2
         
     def b_push_outer_var(self, ctx, arg):
@@ -599,14 +1004,17 @@ class Interp(object):
         # get extended bytecode data
         level = ctx.method[ctx.ip + 6]
 
-        # look through context frames
-        outer = ctx.outerContext
-        while level:
-            outer = outer.outerContext
-            level -= 1
-
         # return temp variable
-        ctx.push(outer[7 + arg])
+        ctx.push(ctx.scopes[level]._refs[arg])
+        ctx.ip += 4
+        
+    def t_push_outer_var(self, ctx, arg):
+        """
+        Threaded code for the B_PUSH_OUTER_TEMP bytecode.
+        The arg holds the variable index and the scope level.
+        """
+        idx, level = arg
+        ctx.push(ctx.scopes[level]._refs[idx])
         ctx.ip += 4
         
     def b_push_recv_var(self, ctx, arg):
@@ -630,6 +1038,7 @@ class Interp(object):
         Execute the B_PUSH_SPECIAL bytecode.
         Push the current method or block context onto the stack.
         """
+        ctx.make_escaped_all()
         ctx.push(ctx)
         ctx.ip += 2
         
@@ -638,7 +1047,7 @@ class Interp(object):
         Execute the B_DUP_STACK_TOP bytecode.
         Push the last stack value onto the stack again.
         """
-        ctx.push(ctx[-1])
+        ctx.push(ctx._refs[-1])
         ctx.ip += 2
         
     def b_pop_top(self, ctx, arg):
@@ -654,7 +1063,7 @@ class Interp(object):
         Execute the B_STORE_TEMPORARY_VARIABLE bytecode.
         Pop from the stack and store a method or block temporary variable.
         """
-        ctx[7 + arg] = ctx.pop()
+        ctx._refs[arg] = ctx.pop()
         ctx.ip += 2
         
     def b_store_outer_var(self, ctx, arg):
@@ -665,13 +1074,17 @@ class Interp(object):
         # get extended bytecode data
         level = ctx.method[ctx.ip + 6]
 
-        # look through context frames
-        outer = ctx.outerContext
-        while level:
-            outer = outer.outerContext
-            level -= 1
         # store temp variable
-        outer[7 + arg] = ctx.pop()
+        ctx.scopes[level]._refs[arg] = ctx.pop()
+        ctx.ip += 4
+        
+    def t_store_outer_var(self, ctx, arg):
+        """
+        Threaded code for the B_STORE_OUTER_TEMP bytecode.
+        The arg holds the variable index and the scope level.
+        """
+        idx, level = arg
+        ctx.scopes[level]._refs[idx] = ctx.pop()
         ctx.ip += 4
         
     def b_store_lit_var(self, ctx, arg):
@@ -716,6 +1129,56 @@ class Interp(object):
         ctx.receiver[arg] = ctx.pop()
         ctx.ip += 2
 
+    def b_jump(self, ctx, arg):
+        """
+        Execute the B_JUMP bytecode.
+        Jump forward unconditionally.
+        """
+        ctx.ip += 4 + (arg | (ctx.method[ctx.ip + 6] << 8))
+        
+    def b_jump_back(self, ctx, arg):
+        """
+        Execute the B_JUMP_BACK bytecode.
+        Jump backward unconditionally.
+        """
+        self.heat_code(ctx.method)
+        ctx.ip += 4 - (arg | (ctx.method[ctx.ip + 6] << 8))
+        
+    def b_pop_jump_true(self, ctx, arg):
+        """
+        Execute the B_POP_JUMP_TRUE bytecode.
+        Pop from the stack and jump forward if the value is true.
+        """
+        cond = ctx.pop()
+        if cond is self._true():
+            ctx.ip += 4 + (arg | (ctx.method[ctx.ip + 6] << 8))
+        elif cond is self._false():
+            ctx.ip += 4
+        else:
+            self._must_be_boolean(ctx, cond)
+        
+    def b_pop_jump_false(self, ctx, arg):
+        """
+        Execute the B_POP_JUMP_FALSE bytecode.
+        Pop from the stack and jump forward if the value is false.
+        """
+        cond = ctx.pop()
+        if cond is self._false():
+            ctx.ip += 4 + (arg | (ctx.method[ctx.ip + 6] << 8))
+        elif cond is self._true():
+            ctx.ip += 4
+        else:
+            self._must_be_boolean(ctx, cond)
+            
+    def _must_be_boolean(self, ctx, cond):
+        """
+        Handle a conditional jump on a value which is not a Boolean.
+        Send mustBeBoolean to the value without advancing the
+        instruction pointer, so the jump is retried with the reply.
+        """
+        ctx.push(cond)
+        self.send_message(0, False, self._sel_must_be_bool(), ctx.ip)
+        
     def b_send(self, ctx, arg):
         """
         Execute the SEND bytecode.
@@ -723,7 +1186,7 @@ class Interp(object):
         context stack.  The reply is pushed onto the stack.
         """
         ctx.ip += 2
-        self.send_message(arg, False, None)
+        self.send_message(arg, False, None, ctx.ip - 2)
         
     def b_send_super(self, ctx, arg):
         """
@@ -740,7 +1203,7 @@ class Interp(object):
         Handles value unary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_value())
+        self.send_message(arg, False, self._sel_value(), ctx.ip - 2)
         
     def b_send_spec_size(self, ctx, arg):
         """
@@ -748,7 +1211,7 @@ class Interp(object):
         Handles size unary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_size())
+        self.send_message(arg, False, self._sel_size(), ctx.ip - 2)
         
     def b_send_spec_isnil(self, ctx, arg):
         """
@@ -756,7 +1219,7 @@ class Interp(object):
         Handles isNil unary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_isnil())
+        self.send_message(arg, False, self._sel_isnil(), ctx.ip - 2)
         
     def b_send_spec_notnil(self, ctx, arg):
         """
@@ -764,7 +1227,7 @@ class Interp(object):
         Handle notNil unary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_notnil())
+        self.send_message(arg, False, self._sel_notnil(), ctx.ip - 2)
         
     def b_send_spec_class(self, ctx, arg):
         """
@@ -772,7 +1235,7 @@ class Interp(object):
         Handles class unary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_class())
+        self.send_message(arg, False, self._sel_class(), ctx.ip - 2)
         
     def b_send_spec_at(self, ctx, arg):
         """
@@ -780,7 +1243,7 @@ class Interp(object):
         Handles at: keyword messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_at())
+        self.send_message(arg, False, self._sel_at(), ctx.ip - 2)
         
     def b_send_spec_at_put(self, ctx, arg):
         """
@@ -788,7 +1251,7 @@ class Interp(object):
         Handles at:put: keyword messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_at_put())
+        self.send_message(arg, False, self._sel_at_put(), ctx.ip - 2)
         
     def b_send_spec_value_colon(self, ctx, arg):
         """
@@ -796,23 +1259,61 @@ class Interp(object):
         Handles value: keyword messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_value_colon())
+        self.send_message(arg, False, self._sel_value_colon(), ctx.ip - 2)
         
     def b_send_spec_plus(self, ctx, arg):
         """
         Execute the B_PLUS_SPECIAL bytecode.
         Handles + binary messages.
         """
+        global Int_Max
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_plus())
+        
+        # SmallInteger and FloatD operands are computed inline,
+        # an overflow answers a LargeInteger like the Kernel does
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if is_int(recv):
+            if is_int(send):
+                x = recv + send
+                if abs(x) > Int_Max:
+                    x = LargeInteger.from_int(x)
+                refs.pop()
+                refs[-1] = x
+                return
+        elif is_flt(recv) and is_flt(send):
+            refs.pop()
+            refs[-1] = recv + send
+            return
+        self.send_message(arg, False, self._sel_plus(), ctx.ip - 2)
         
     def b_send_spec_minus(self, ctx, arg):
         """
         Execute the B_MINUS_SPECIAL bytecode.
         Handles - binary messages.
         """
+        global Int_Max
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_minus())
+        
+        # SmallInteger and FloatD operands are computed inline,
+        # an overflow answers a LargeInteger like the Kernel does
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if is_int(recv):
+            if is_int(send):
+                x = recv - send
+                if abs(x) > Int_Max:
+                    x = LargeInteger.from_int(x)
+                refs.pop()
+                refs[-1] = x
+                return
+        elif is_flt(recv) and is_flt(send):
+            refs.pop()
+            refs[-1] = recv - send
+            return
+        self.send_message(arg, False, self._sel_minus(), ctx.ip - 2)
         
     def b_send_spec_less_than(self, ctx, arg):
         """
@@ -820,7 +1321,19 @@ class Interp(object):
         Handles < binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_less_than())
+        
+        # SmallInteger and FloatD operands are compared inline
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if (is_int(recv) and is_int(send)) or (is_flt(recv) and is_flt(send)):
+            refs.pop()
+            if recv < send:
+                refs[-1] = self._true()
+            else:
+                refs[-1] = self._false()
+            return
+        self.send_message(arg, False, self._sel_less_than(), ctx.ip - 2)
         
     def b_send_spec_greater_than(self, ctx, arg):
         """
@@ -828,7 +1341,19 @@ class Interp(object):
         Handles > binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_greater_than())
+        
+        # SmallInteger and FloatD operands are compared inline
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if (is_int(recv) and is_int(send)) or (is_flt(recv) and is_flt(send)):
+            refs.pop()
+            if recv > send:
+                refs[-1] = self._true()
+            else:
+                refs[-1] = self._false()
+            return
+        self.send_message(arg, False, self._sel_greater_than(), ctx.ip - 2)
         
     def b_send_spec_less_equ(self, ctx, arg):
         """
@@ -836,7 +1361,19 @@ class Interp(object):
         Handles <= binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_less_equ())
+        
+        # SmallInteger and FloatD operands are compared inline
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if (is_int(recv) and is_int(send)) or (is_flt(recv) and is_flt(send)):
+            refs.pop()
+            if recv <= send:
+                refs[-1] = self._true()
+            else:
+                refs[-1] = self._false()
+            return
+        self.send_message(arg, False, self._sel_less_equ(), ctx.ip - 2)
         
     def b_send_spec_greater_equ(self, ctx, arg):
         """
@@ -844,7 +1381,19 @@ class Interp(object):
         Handles >= binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_greater_equ())
+        
+        # SmallInteger and FloatD operands are compared inline
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if (is_int(recv) and is_int(send)) or (is_flt(recv) and is_flt(send)):
+            refs.pop()
+            if recv >= send:
+                refs[-1] = self._true()
+            else:
+                refs[-1] = self._false()
+            return
+        self.send_message(arg, False, self._sel_greater_equ(), ctx.ip - 2)
         
     def b_send_spec_equal(self, ctx, arg):
         """
@@ -852,7 +1401,19 @@ class Interp(object):
         Handles = binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_equal())
+        
+        # SmallInteger and FloatD operands are compared inline
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if (is_int(recv) and is_int(send)) or (is_flt(recv) and is_flt(send)):
+            refs.pop()
+            if recv == send:
+                refs[-1] = self._true()
+            else:
+                refs[-1] = self._false()
+            return
+        self.send_message(arg, False, self._sel_equal(), ctx.ip - 2)
         
     def b_send_spec_not_equal(self, ctx, arg):
         """
@@ -860,15 +1421,46 @@ class Interp(object):
         Handles ~= binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_not_equal())
+        
+        # SmallInteger and FloatD operands are compared inline
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if (is_int(recv) and is_int(send)) or (is_flt(recv) and is_flt(send)):
+            refs.pop()
+            if recv != send:
+                refs[-1] = self._true()
+            else:
+                refs[-1] = self._false()
+            return
+        self.send_message(arg, False, self._sel_not_equal(), ctx.ip - 2)
         
     def b_send_spec_times(self, ctx, arg):
         """
         Execute the B_TIMES_SPECIAL bytecode.
         Handles * binary messages.
         """
+        global Int_Max
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_times())
+        
+        # SmallInteger and FloatD operands are computed inline,
+        # an overflow answers a LargeInteger like the Kernel does
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if is_int(recv):
+            if is_int(send):
+                x = recv * send
+                if abs(x) > Int_Max:
+                    x = LargeInteger.from_int(x)
+                refs.pop()
+                refs[-1] = x
+                return
+        elif is_flt(recv) and is_flt(send):
+            refs.pop()
+            refs[-1] = recv * send
+            return
+        self.send_message(arg, False, self._sel_times(), ctx.ip - 2)
         
     def b_send_spec_divide(self, ctx, arg):
         """
@@ -876,7 +1468,22 @@ class Interp(object):
         Handles / binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_divide())
+        
+        # exact SmallInteger quotients and FloatD operands are
+        # computed inline, Fractions and division by zero are not
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if is_int(recv):
+            if is_int(send) and (send != 0) and (recv % send == 0):
+                refs.pop()
+                refs[-1] = recv // send
+                return
+        elif is_flt(recv) and is_flt(send) and (send != 0.0):
+            refs.pop()
+            refs[-1] = recv / send
+            return
+        self.send_message(arg, False, self._sel_divide(), ctx.ip - 2)
         
     def b_send_spec_int_divide(self, ctx, arg):
         """
@@ -884,7 +1491,17 @@ class Interp(object):
         Handles // binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_int_divide())
+        
+        # SmallInteger operands are computed inline
+        # unless dividing by zero
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if is_int(recv) and is_int(send) and (send != 0):
+            refs.pop()
+            refs[-1] = recv // send
+            return
+        self.send_message(arg, False, self._sel_int_divide(), ctx.ip - 2)
         
     def b_send_spec_remainder(self, ctx, arg):
         """
@@ -892,7 +1509,17 @@ class Interp(object):
         Handles \\ binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_remainder())
+        
+        # SmallInteger operands are computed inline
+        # unless dividing by zero
+        refs = ctx._refs
+        recv = refs[-2]
+        send = refs[-1]
+        if is_int(recv) and is_int(send) and (send != 0):
+            refs.pop()
+            refs[-1] = recv % send
+            return
+        self.send_message(arg, False, self._sel_remainder(), ctx.ip - 2)
         
     def b_send_spec_identity(self, ctx, arg):
         """
@@ -900,7 +1527,7 @@ class Interp(object):
         Handles == binary messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_identity())
+        self.send_message(arg, False, self._sel_identity(), ctx.ip - 2)
         
     def b_send_spec_bit_and(self, ctx, arg):
         """
@@ -908,7 +1535,7 @@ class Interp(object):
         Handles bitAnd: keyword messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_bit_and())
+        self.send_message(arg, False, self._sel_bit_and(), ctx.ip - 2)
         
     def b_send_spec_bit_or(self, ctx, arg):
         """
@@ -916,7 +1543,7 @@ class Interp(object):
         Handles bitOr: keyword messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_bit_or())
+        self.send_message(arg, False, self._sel_bit_or(), ctx.ip - 2)
         
     def b_send_spec_bit_xor(self, ctx, arg):
         """
@@ -924,7 +1551,7 @@ class Interp(object):
         Handles bitXor: keyword messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_bit_xor())
+        self.send_message(arg, False, self._sel_bit_xor(), ctx.ip - 2)
         
     def b_send_spec_bit_shift(self, ctx, arg):
         """
@@ -932,38 +1559,155 @@ class Interp(object):
         Handles bitShift: keyword messages.
         """
         ctx.ip += 2
-        self.send_message(arg, False, self._sel_bit_shift())
+        self.send_message(arg, False, self._sel_bit_shift(), ctx.ip - 2)
+        
+    def b_send_unary_lit(self, ctx, arg):
+        """
+        Execute the B_SEND_UNARY_LIT superinstruction.
+        Push a selector literal and send it with no arguments.
+        """
+        ctx.ip += 4
+        self.send_message(0, False, ctx.method.literals[arg], ctx.ip - 2)
+        
+    def b_push_self_push_lit(self, ctx, arg):
+        """
+        Execute the B_PUSH_SELF_PUSH_LIT superinstruction.
+        """
+        ctx.push(ctx.receiver)
+        ctx.push(self.lit_const(ctx, ctx.method.get_code()[ctx.ip + 3]))
+        ctx.ip += 4
+        
+    def b_push_temp_push_lit(self, ctx, arg):
+        """
+        Execute the B_PUSH_TEMP_PUSH_LIT superinstruction.
+        """
+        ctx.push(ctx._refs[arg])
+        ctx.push(self.lit_const(ctx, ctx.method.get_code()[ctx.ip + 3]))
+        ctx.ip += 4
+        
+    def b_push_lit_push_temp(self, ctx, arg):
+        """
+        Execute the B_PUSH_LIT_PUSH_TEMP superinstruction.
+        """
+        ctx.push(self.lit_const(ctx, arg))
+        ctx.push(ctx._refs[ctx.method.get_code()[ctx.ip + 3]])
+        ctx.ip += 4
+        
+    def b_push_temp_push_temp(self, ctx, arg):
+        """
+        Execute the B_PUSH_TEMP_PUSH_TEMP superinstruction.
+        """
+        ctx.push(ctx._refs[arg])
+        ctx.push(ctx._refs[ctx.method.get_code()[ctx.ip + 3]])
+        ctx.ip += 4
+        
+    def b_store_temp_push_temp(self, ctx, arg):
+        """
+        Execute the B_STORE_TEMP_PUSH_TEMP superinstruction.
+        """
+        ctx._refs[arg] = ctx.pop()
+        ctx.push(ctx._refs[ctx.method.get_code()[ctx.ip + 3]])
+        ctx.ip += 4
+        
+    def b_pop_push_self(self, ctx, arg):
+        """
+        Execute the B_POP_PUSH_SELF superinstruction.
+        """
+        ctx.pop()
+        ctx.push(ctx.receiver)
+        ctx.ip += 4
+        
+    def b_pop_push_temp(self, ctx, arg):
+        """
+        Execute the B_POP_PUSH_TEMP superinstruction.
+        """
+        ctx.pop()
+        ctx.push(ctx._refs[ctx.method.get_code()[ctx.ip + 3]])
+        ctx.ip += 4
+        
+    def b_push_temps_special(self, ctx, arg):
+        """
+        Execute the B_PUSH_TEMPS_SPECIAL superinstruction.
+        Push two temporaries and send a special selector.
+        """
+        code = ctx.method.get_code()
+        ip = ctx.ip
+        ctx.push(ctx._refs[arg])
+        ctx.push(ctx._refs[code[ip + 3]])
+        ctx.ip = ip + 4
+        self.b_table[code[ip + 4]](ctx, code[ip + 5])
         
     def b_meth_ret(self, ctx, arg):
         """
         Execute the B_RETURN_METHOD_STACK_TOP bytecode.
         """
-        # we may be nested in blocks
-        # unwind until method context
-        outCtx = ctx
-        while not is_int(outCtx[6]):
-            outCtx = outCtx.outerContext
-        
-        # get sender parent context
-        newCtx = outCtx.parent
+        # a block returns from its home method context
+        if isinstance(ctx, MethodContext):
+            homeCtx = ctx
+        else:
+            homeCtx = ctx.home
+            if homeCtx.is_nil() or homeCtx.parent.is_nil():
+                # the home method already returned, return from
+                # the block instead and send the error message
+                # to the return value above the block's sender,
+                # from a method named for this return
+                val = ctx[-1]
+                self.b_blk_ret(ctx, arg)
+                methObj = self._bad_return_method
+                if methObj is None:
+                    methObj = self.make_method(self._sys.k_object(), self._sel_dead_return(),
+                                  (B_SEND, 0, B_POP_STACK_TOP, 0, B_EXIT_INTERPRETER, 0))
+                    self._bad_return_method = methObj
+                self.start_context(methObj, val, (val, self._sel_bad_return()))
+                return
         
         # pop return value from current stack
         # and push onto sender's stack
-        newCtx.push(ctx.pop())
+        newCtx = homeCtx.parent
+        val = ctx.pop()
         
-        # free context objects including any 
-        # skipped over to get to outer context
-        while not outCtx.is_same(ctx):
+        if ctx is not homeCtx:
+            newCtx = self.unwind(ctx, homeCtx, newCtx)
+        else:
+            self.free_mth_context(ctx)
+        
+        # return control to sender
+        newCtx.push(val)
+        self.i_context = newCtx
+        
+    def unwind(self, ctx, homeCtx, newCtx):
+        """
+        Release the contexts from ctx up to and including
+        homeCtx in one pass, for a non-local return to newCtx.
+        Unwind contexts on the way (#ensure: and #on:do:) are
+        kept and chained instead, each returning to the next
+        one and the last to newCtx.  Returns the context that
+        receives the return value.
+        """
+        firstCtx = None
+        lastCtx = None
+        while True:
             parent = ctx.parent
-            if is_int(ctx[6]):
-                self.free_mth_context(ctx)
+            if isinstance(ctx, MethodContext):
+                if (ctx.flags & 2) and (ctx is not homeCtx):
+                    # resume only once
+                    ctx.flags &= ~2
+                    if lastCtx is None:
+                        firstCtx = ctx
+                    else:
+                        lastCtx.parent = ctx
+                    lastCtx = ctx
+                else:
+                    self.free_mth_context(ctx)
             else:
                 self.free_blk_context(ctx)
+            if ctx is homeCtx:
+                break
             ctx = parent
-        self.free_mth_context(outCtx)
-        
-        # return control to sender
-        self.i_context = newCtx
+        if lastCtx is None:
+            return newCtx
+        lastCtx.parent = newCtx
+        return firstCtx
         
     def b_blk_ret(self, ctx, arg):
         """
@@ -981,6 +1725,16 @@ class Interp(object):
 
         # return control to sender
         self.i_context = newCtx
+        
+    def b_exit_interp(self, ctx, arg):
+        """
+        Execute B_EXIT_INTERPRETER bytecode.
+        Return to the sender without a reply.  This ends
+        the contexts the interpreter starts by itself.
+        """
+        newCtx = ctx.parent
+        self.free_mth_context(ctx)
+        self.i_context = newCtx
 
     def p_Object_basicSize(self, ctx, recv, argList):
         """
@@ -1044,7 +1798,7 @@ class Interp(object):
                 val = argList[1]
                 try:
                     recv[(spec >> 12) + idx - 1] = val
-                except IndexError:
+                except (IndexError, ValueError):
                     return False
                 ctx.push(val)
                 return True
@@ -1058,6 +1812,10 @@ class Interp(object):
             klass = recv.get_class()
             if klass is self._sys.k_bytearray():
                 recv = ByteArray.from_seq(recv)
+            elif klass is self._sys.k_string():
+                recv = String.from_bytes(recv._refs)
+            elif self._is_large_int(recv):
+                recv = type(recv).from_seq(recv._refs)
             else:
                 newObj = Object.from_seq(recv)
                 newObj.set_class(klass)
@@ -1099,9 +1857,12 @@ class Interp(object):
             for obj in Object.get_all_obj():
                 for idx,ref in enumerate(obj):
                     # search through this object's references
-                    if is_obj(ref) and ref.is_same(recv):
+                    if ref is recv:
                         # replace references with new object
                         obj[idx] = send
+            
+            # cached lookups may refer to the old object
+            self.flush_cache()
             ctx.push(recv)
             return True
         return False
@@ -1117,7 +1878,7 @@ class Interp(object):
             # other objects
             for obj in Object.get_all_obj():
                 for ref in obj:
-                    if is_obj(ref) and ref.is_same(recv):
+                    if ref is recv:
                         refList.append(obj)
                         break
         ctx.push(Array.from_seq(refList))
@@ -1129,8 +1890,7 @@ class Interp(object):
         """
         send = argList[0]
         if is_obj(send) and (send.get_class() is self._sys.k_symbol()):
-            ctx.push(self.send_message_intern(recv, send, argList[1:]))
-            return True
+            return self.perform(ctx, recv, send, argList[1:])
         return False
         
     def p_Object_performWithArguments(self, ctx, recv, argList):
@@ -1142,34 +1902,49 @@ class Interp(object):
         if is_obj(send) and is_obj(argArr) and \
            (argArr.get_class() is self._sys.k_array()) and \
            (send.get_class() is self._sys.k_symbol()):
-                ctx.push(self.send_message_intern(recv, send, argArr))
-                return True
+                return self.perform(ctx, recv, send, argArr.get_refs())
         return False
+        
+    def perform(self, ctx, recv, selObj, args):
+        """
+        Send a message on behalf of a perform primitive.  The
+        reply is pushed on the sender's stack by the normal
+        return of the new context.  Fails if the method takes
+        a different number of arguments.
+        """
+        methObj = self.lookup_method(self._obj_class(recv), selObj)
+        if (not methObj.is_nil()) and (methObj.get_hdr()[0] != len(args)):
+            return False
+        ctx.push(recv)
+        for arg in args:
+            ctx.push(arg)
+        self.send_message(len(args), False, selObj)
+        return True
     
     def p_Object_makeWeak(self, ctx, recv, argList):
         """
         Primitive handler for Object makeWeak.
         Make the all of the receiver references weak.
         """
-        if is_obj(recv):
-            weak = WeakObject.from_obj(recv)
-            status = self.p_Object_become(ctx, recv, (weak,))
-            if status:
-                ctx.pop()
-        ctx.push(recv)
-        return True
+        if is_obj(recv) and not recv.is_readonly():
+            try:
+                WeakObject.from_obj(recv)
+            except TypeError:
+                return False
+            ctx.push(recv)
+            return True
+        return False
     
     def p_Object_makeEphemeron(self, ctx, recv, argList):
         """
         Primitive handler for Object makeEphemeron.
         Make the first receiver reference weak.
         """
-        if is_obj(recv) and (recv.size >= 1):
-            ephem = EphemObject.from_obj(recv)
-            status = self.p_Object_become(ctx, recv, (ephem,))
-            if not status:
-                return status
-            ctx.pop()
+        if is_obj(recv) and (recv.size >= 1) and not recv.is_readonly():
+            try:
+                EphemObject.from_obj(recv)
+            except TypeError:
+                return False
             ctx.push(recv)
             return True
         return False
@@ -1222,15 +1997,11 @@ class Interp(object):
         newCtx.parent       = ctx
         newCtx.receiver     = recv.receiver
         newCtx.method       = blkObj
-        newCtx.outerContext = recv.outerContext
+        newCtx.set_outer(recv.outerContext)
         
-        # copy arguments to new stack
-        for arg in argList:
-            newCtx.push(arg)
-                
-        # mske room for any temporary variables
-        if numTemp:
-            newCtx.expand(numTemp)
+        # the argument list becomes the new stack
+        # with room for any temporary variables
+        newCtx.take_args(argList, numTemp)
 
         # transfer control to new context
         self.i_context = newCtx
@@ -1255,15 +2026,11 @@ class Interp(object):
         newCtx.parent       = ctx
         newCtx.receiver     = recv.receiver
         newCtx.method       = blkObj
-        newCtx.outerContext = recv.outerContext
+        newCtx.set_outer(recv.outerContext)
         
-        # copy arguments to new stack
-        for arg in argList:
-            newCtx.push(arg)
-                
-        # mske room for any temporary variables
-        if numTemp:
-            newCtx.expand(numTemp)
+        # the argument list becomes the new stack
+        # with room for any temporary variables
+        newCtx.take_args(argList, numTemp)
 
         # transfer control to new context
         self.i_context = newCtx
@@ -1290,15 +2057,11 @@ class Interp(object):
         newCtx.parent       = ctx
         newCtx.receiver     = recv.receiver
         newCtx.method       = blkObj
-        newCtx.outerContext = recv.outerContext
+        newCtx.set_outer(recv.outerContext)
         
-        # copy arguments to new stack
-        for arg in argList:
-            newCtx.push(arg)
-                
-        # mske room for any temporary variables
-        if numTemp:
-            newCtx.expand(numTemp)
+        # copy arguments to new stack and
+        # make room for any temporary variables
+        newCtx.push_args(argList, numTemp)
 
         # transfer control to new context
         self.i_context = newCtx
@@ -1314,12 +2077,17 @@ class Interp(object):
         if numHdrArgs != 0:
             return False
 
+        # the sender resumes when a non-local
+        # return unwinds through it
+        if isinstance(ctx, MethodContext):
+            ctx.flags |= 2
+            
         # allocate a new context and link to old
         newCtx              = self.alloc_blk_context()
         newCtx.parent       = ctx
         newCtx.receiver     = recv.receiver
         newCtx.method       = blkObj
-        newCtx.outerContext = recv.outerContext
+        newCtx.set_outer(recv.outerContext)
                 
         # mske room for any temporary variables
         if numTemp:
@@ -1341,15 +2109,30 @@ class Interp(object):
         Create a new instance of a object based on class definition.
         For objects of fixed size.
         """
-        if is_obj(recv) and (recv.get_class().get_class() is self._sys.k_metaclass()):
-            spec = recv.instanceSpec
-            if spec & 0x10:
-                obj = Object(spec >> 12)
-                obj.set_class(recv)
-                ctx.push(obj)
-                return True
+        tmpl = self.new_template(recv)
+        if tmpl is not None:
+            ctx.push(Object.from_template(recv, tmpl.refs))
+            return True
         return False
         
+    def new_template(self, klassObj):
+        """
+        Return the allocation template of a class with fixed
+        size instances, building it if needed.  Returns None
+        if the instances are not of fixed size.
+        """
+        tmpl = getattr(klassObj, "_new_tmpl", None)
+        if (tmpl is not None) and (tmpl.spec == klassObj._refs[2]):
+            return tmpl
+        if isinstance(klassObj, Class) and \
+                (klassObj.get_class().get_class() is self._sys.k_metaclass()):
+            spec = klassObj.instanceSpec
+            if spec & 0x10:
+                tmpl = NewTemplate(spec, [self._nil()] * (spec >> 12))
+                klassObj._new_tmpl = tmpl
+                return tmpl
+        return None
+        
     def p_Behavior_basicNewColon(self, ctx, recv, argList):
         """
         Primitiive handler for Behavior basicNew:
@@ -1360,8 +2143,12 @@ class Interp(object):
         if is_obj(recv) and is_int(sz) and (recv.get_class().get_class() is self._sys.k_metaclass()):
             spec = recv.instanceSpec
             if not (spec & 0x10):
-                obj = Object((spec >> 12) + sz)
-                obj.set_class(recv)
+                if recv is self._sys.k_string():
+                    # Strings are stored as bytes
+                    obj = String(sz)
+                else:
+                    obj = Object((spec >> 12) + sz)
+                    obj.set_class(recv)
                 ctx.push(obj)
                 return True
         return False
@@ -1373,13 +2160,11 @@ class Interp(object):
         Send initialize message to the new object after creation.
         For objects of fixed size.
         """
-        # create the object
-        status = self.p_Behavior_basicNew(ctx, recv, argList)
-        
-        if status:
-            # send the new object initialize message
-            self.send_message_intern(ctx[-1], self._sel_initialize(), ())
-        return status
+        tmpl = self.new_template(recv)
+        if tmpl is not None:
+            self.initialize_object(ctx, recv, Object.from_template(recv, tmpl.refs))
+            return True
+        return False
         
     def p_Behavior_newColonInitialize(self, ctx, recv, argList):
         """
@@ -1393,9 +2178,40 @@ class Interp(object):
         
         if status:
             # send the new object initialize message
-            self.send_message_intern(ctx[-1], self._sel_initialize(), ())
+            self.initialize_object(ctx, recv, ctx.pop())
         return status
         
+    def initialize_object(self, ctx, recv, obj):
+        """
+        Send initialize to a new object and answer the object
+        to the sender of new.  Trivial methods, like the empty
+        Object>>initialize, are run directly.  Otherwise a context
+        is started which sends initialize and returns the object,
+        as if new had been sent to recv.
+        """
+        methObj = self.lookup_method(obj.get_class(), self._sel_initialize())
+        if not methObj.is_nil():
+            quick = methObj.get_quick()
+            if quick:
+                self.quick_method(methObj, quick, obj, ())
+                ctx.push(obj)
+                return
+        methObj = self._init_method
+        if methObj is None:
+            methObj = self.make_method(self._sys.k_behavior(), self._sys.symbol_find_or_add("new"),
+                          (B_SEND, 0, B_POP_STACK_TOP, 0, B_RETURN_METHOD_STACK_TOP, 0))
+            self._init_method = methObj
+        self.start_context(methObj, recv, (obj, obj, self._sel_initialize()))
+        
+    def p_Behavior_flushCache(self, ctx, recv, argList):
+        """
+        Primitive handler for Behavior flushCache
+        Invalidate the global method cache.
+        """
+        self.flush_cache()
+        ctx.push(recv)
+        return True
+        
     def p_Character_create(self, ctx, recv, argList):
         """
         Primitve handler for Character value:
@@ -1510,10 +2326,8 @@ class Interp(object):
         if is_int(send):
             if send == 0:
                 return False
-            quo = recv / send
-            rnd = round(quo)
-            if math.isclose(rnd, quo):
-                ret = int(rnd)
+            if recv % send == 0:
+                ret = recv // send
             else:
                 ret = Fraction(recv, send)
             ctx.push(ret)
@@ -1871,7 +2685,7 @@ class Interp(object):
         """
         Primitive handler for LargeInteger hash
         """
-        ctx.push(hsh_seq(recv))
+        ctx.push(hsh_seq(recv._refs))
         return True
         
     def p_LargePositiveInteger_basicNewColon(self, ctx, recv, argList):
@@ -2523,6 +3337,12 @@ class Interp(object):
         replaceStart    = argList[3]
         if is_int(start) and is_int(stop) and is_int(replaceStart) and \
                 (start > 0) and (replaceStart > 0) and is_obj(replaceArr):
+            if isinstance(recv, String) and isinstance(replaceArr, String):
+                # copy the bytes directly
+                if not self._replace_bytes(recv, start, stop, replaceArr, replaceStart):
+                    return False
+                ctx.push(recv)
+                return True
             n = stop - start + 1
             start += recv.get_class().get_num_inst() - 2
             replaceStart += replaceArr.get_class().get_num_inst() - 2
@@ -2530,7 +3350,7 @@ class Interp(object):
                 while n > 0:
                     recv[start + n] = replaceArr[replaceStart + n]
                     n -= 1
-            except IndexError:
+            except (IndexError, ValueError):
                 return False
             ctx.push(recv)
             return True
@@ -2542,6 +3362,15 @@ class Interp(object):
         """
         item    = argList[0]
         start   = argList[1]
+        if is_int(start) and (start > 0) and isinstance(recv, String):
+            # search the bytes for the character value
+            if not isinstance(item, Character):
+                return False
+            idx = recv._refs.find(item.codePoint, start - 1)
+            if idx < 0:
+                return False
+            ctx.push(idx + 1)
+            return True
         if is_int(start) and (start > 0):
             stop = recv.size
             numRecv = recv.get_class().get_num_inst()
@@ -2560,6 +3389,13 @@ class Interp(object):
         Primitve handler for Array =
         """
         send = argList[0]
+        if isinstance(recv, String) and isinstance(send, String):
+            # compare the bytes directly
+            if recv._refs == send._refs:
+                ctx.push(self._true())
+            else:
+                ctx.push(self._false())
+            return True
         if is_obj(send):
             if recv.size == send.size:
                 ret = self._true()
@@ -2578,6 +3414,12 @@ class Interp(object):
         Primitve handler for CharacterArray valueAt:
         """
         idx = argList[0]
+        if is_int(idx) and (idx > 0) and isinstance(recv, String):
+            try:
+                ctx.push(recv._refs[idx - 1])
+            except IndexError:
+                return False
+            return True
         if is_int(idx):
             spec = recv.get_class().instanceSpec
             try:
@@ -2600,7 +3442,7 @@ class Interp(object):
             spec = recv.get_class().instanceSpec
             try:
                 recv[(spec >> 12) + idx - 1] = self._sys.o_char[val]
-            except IndexError:
+            except (IndexError, ValueError):
                 return False
             ctx.push(val)
             return True
@@ -2627,7 +3469,7 @@ class Interp(object):
         
         if status:
             # send the new object initialize message
-            self.send_message_intern(ctx[-1], self._sel_initialize(), ())
+            self.initialize_object(ctx, recv, ctx.pop())
         return status
         
     def p_ByteArray_replaceFromToWithStringStartingAt(self, ctx, recv, argList):
@@ -2642,17 +3484,7 @@ class Interp(object):
         if is_int(start) and is_int(stop) and is_int(replaceStart) and \
            (start > 0) and (replaceStart > 0) and \
            is_obj(replaceArr) and (replaceArr.get_class() is self._sys.k_string()):
-                n = stop - start + 1
-                start -= 2
-                replaceStart -= 2 
-                try:
-                    while n > 0:
-                        c = replaceArr[replaceStart + n]
-                        if c.is_nil():
-                            return False
-                        recv[start + n] = c[0]
-                        n -= 1
-                except IndexError:
+                if not self._replace_bytes(recv, start, stop, replaceArr, replaceStart):
                     return False
                 ctx.push(recv)
                 return True
@@ -2697,15 +3529,9 @@ class Interp(object):
         replaceStart    = argList[3]
         if is_int(start) and is_int(stop) and is_int(replaceStart) and \
            (start > 0) and (replaceStart > 0) and \
-           is_obj(replaceArr) and (replaceArr.get_class() is self._sys.k_bytearray()):
-                n = stop - start + 1
-                start -= 2
-                replaceStart -= 2
-                try:
-                    while n > 0:
-                        recv[start + n] = self._sys.o_char[replaceArr[replaceStart + n]]
-                        n -= 1
-                except IndexError:
+           is_obj(replaceArr) and (replaceArr.get_class() is self._sys.k_bytearray()) and \
+           isinstance(recv, String):
+                if not self._replace_bytes(recv, start, stop, replaceArr, replaceStart):
                     return False
                 ctx.push(recv)
                 return True
@@ -2715,12 +3541,9 @@ class Interp(object):
         """
         Primitve handler for String hash
         """
-        stop = recv.size
-        arr = bytearray(stop)
-        status = self.p_ByteArray_replaceFromToWithStringStartingAt(ctx, arr, (1, stop, recv, 1))
-        if not status:
-            return status
-        ctx.push(hsh_seq(ctx.pop()))
+        if not isinstance(recv, String):
+            return False
+        ctx.push(hsh_seq(recv._refs))
         return True
         
     def p_Symbol_intern(self, ctx, recv, argList):
@@ -2730,12 +3553,7 @@ class Interp(object):
         """
         send = argList[0]
         if is_obj(send) and (send.get_class() is self._sys.k_string()):
-            s = ''
-            for c in send:
-                if c.is_nil():
-                    return False
-                s += chr(c[0])
-            ctx.push(self._sys.symbol_find_or_add(s))
+            ctx.push(self._sys.symbol_find_or_add(send.to_str()))
             return True
         return False
         
@@ -2986,6 +3804,9 @@ class Interp(object):
             recv[3] = len(self.i_slab_blk)      # numBlockSlab
             recv[4] = self.i_alloc_blk          # numBlockAlloc
             recv[5] = sys.getallocatedblocks()  # numPyBlock
+            recv[6] = self.i_pool_limit         # poolLimit
+            recv[7] = self.i_drop_mth           # numMethodDrop
+            recv[8] = self.i_drop_blk           # numBlockDrop
             ctx.push(recv)
             return True
         return False
@@ -3001,6 +3822,17 @@ class Interp(object):
             return True
         return False
         
+    def p_ObjectMemory_compact(self, ctx, recv, argList):
+        """
+        Primitve handler for ObjectMemory compact
+        """
+        self._sys.collect()
+        ctx.push(recv)
+        # mourn what was collected before returning
+        if self.i_mourn:
+            self.start_mourning()
+        return True
+        
     def _is_large_int(self, x):
         """
         Returns True if a descenent of LargeInteger, 
@@ -3031,12 +3863,21 @@ class Interp(object):
         """
         Convert String to python str
         """
-        s = ""
-        for c in strObj:
-            if not c.is_nil():
-                s += chr(c[0])
-        return s
+        return strObj.to_str()
     
+    @staticmethod
+    def _replace_bytes(dst, start, stop, src, srcStart):
+        """
+        Copy bytes from src starting at srcStart into dst from
+        start to stop.  Both are 1 based indices into Strings or
+        ByteArrays.  Returns False if the ranges are invalid.
+        """
+        n = stop - start + 1
+        if (n < 0) or (stop > len(dst._refs)) or (srcStart - 1 + n > len(src._refs)):
+            return False
+        dst._refs[start - 1 : stop] = src._refs[srcStart - 1 : srcStart - 1 + n]
+        return True
+        
     @staticmethod
     def _utc_offset():
         """
@@ -3087,14 +3928,10 @@ class Interp(object):
         data  = argList[1]
         start = argList[2]
         stop  = argList[3]
-        num   = stop - start + 1
-        arr = bytearray(num)
-        status = self.p_ByteArray_replaceFromToWithStringStartingAt(ctx, 
-                                                                    arr, 
-                                                                    (1, num, data, start))
-        if not status:
-            return status
-        ctx.push(os.write(recv[1], ctx.pop()))
+        if not (isinstance(data, String) and is_int(start) and is_int(stop) and \
+                (start > 0) and (stop <= data.size)):
+            return False
+        ctx.push(os.write(recv[1], data._refs[start - 1 : stop]))
         return True
         
     def f_get_chars(self, ctx, recv, argList):
@@ -3104,14 +3941,12 @@ class Interp(object):
         data  = argList[1]
         start = argList[2]
         stop  = argList[3] 
-        arr = ByteArray(stop - start + 1)
-        num = os.readinto(recv[1], arr._refs)
-        status = self.p_String_replaceFromToWithByteArrayStartingAt(ctx, 
-                                                                    data, 
-                                                                    (start, start + num, arr, 1))
-        if not status:
-            return status
-        ctx.pop()
+        if not (isinstance(data, String) and is_int(start) and is_int(stop) and \
+                (start > 0) and (stop <= data.size)):
+            return False
+        # read straight into the String bytes
+        with memoryview(data._refs) as buf:
+            num = os.readinto(recv[1], buf[start - 1 : stop])
         ctx.push(num)
         return True
         
@@ -0,0 +1,50 @@
+"""
+Measure the memory used by each Smalltalk object
+"""
+
+import sys
+import gc
+import tracemalloc
+from st import *
+
+
+def measure(name, count, create):
+    """
+    Allocate count objects and print the number of bytes
+    used per object, including any object table entry
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objList = [create(n) for n in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    # do not count the list holding the objects
+    used -= sys.getsizeof(objList)
+    print("%-12s %9d objects %6.1f bytes/object (instance %d bytes)" % \
+          (name, count, used / count, sys.getsizeof(objList[0])))
+    del objList
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+
+    # setup command line parser
+    parser = ArgumentParser(prog = "membench.py",
+                            description = "Measure the memory used by each Smalltalk object")
+    parser.add_argument("-n", "--count",
+                        action = "store",
+                        type = int,
+                        default = 1000000,
+                        help = "number of objects to allocate")
+
+    # get command line values
+    args = parser.parse_args()
+
+    # Array sizes are typical of small collections
+    measure("Array(0)", args.count, lambda n: Array(0))
+    measure("Array(4)", args.count, lambda n: Array(4))
+    measure("Association", args.count, lambda n: Association(n, n))
+
@@ -50,6 +50,24 @@ if __name__ == '__main__':
                         type = str,
                         nargs = 1,
                         help = "set debug breakpoint")
+    parser.add_argument("-c", "--cache-stats",
+                        action = "store_true",
+                        default = False,
+                        help = "display send site cache statistics on exit")
+    parser.add_argument("-n", "--no-threaded",
+                        action = "store_true",
+                        default = False,
+                        help = "execute bytecodes without threaded code")
+    parser.add_argument("-p", "--pool-limit",
+                        action = "store",
+                        type = int,
+                        default = 4096,
+                        help = "number of free contexts kept in each context pool")
+    parser.add_argument("-g", "--ngrams",
+                        action = "store",
+                        type = int,
+                        default = 0,
+                        help = "display the most common bytecode sequences of length N on exit")
                         
     # get command line values
     args = parser.parse_args()
@@ -60,6 +78,10 @@ if __name__ == '__main__':
     else:
         context = Smalltalk.load(args, PYST_DIR, parse_break(args.breakpoint))
     Smalltalk.run(context)
+    if args.cache_stats:
+        Smalltalk.send_stats_print()
+    if args.ngrams > 0:
+        Smalltalk.ngram_stats_print(args.ngrams, 25)
     
     
     
\ No newline at end of file
@@ -5,6 +5,7 @@ Common definitions of Smalltalk fundamental types
 import sys
 import os
 import weakref
+import gc
 from copy import copy
 from struct import pack, unpack
 
@@ -58,10 +59,34 @@ def set_obj_char(x):
     
 def set_obj_del(x):
     """
-    Set the handler objects when they are garbage collected
+    Set the handler for weakly referenced objects
+    when they are garbage collected
     """
     global _Obj_Del
     _Obj_Del = x
+    if obj_collect not in gc.callbacks:
+        gc.callbacks.append(obj_collect)
+    
+def obj_finalize(weakOwners):
+    """
+    Called when an Object with weak owners is garbage
+    collected.  Only these Objects have a finalizer,
+    all others are simply freed by reference counting.
+    """
+    global _Obj_Del
+    if weakOwners and (_Obj_Del is not None):
+        _Obj_Del(weakOwners)
+        
+def obj_collect(phase, info):
+    """
+    Called after each python garbage collection to find
+    the ephemerons that need to be mourned
+    """
+    global _Obj_Del
+    if (phase == "stop") and (_Obj_Del is not None):
+        mournList = EphemObject.find_mourners()
+        if mournList:
+            _Obj_Del(mournList)
     
 def hsh_scram(x):
     """
@@ -91,7 +116,9 @@ def hsh_seq(x):
     
 class _ObjTableBase(object):
     """
-    Maintain a unique ID for every Object in the system
+    Maintain a unique ID for every Object in the system.
+    IDs are only allocated when they are asked for, so the
+    table only holds the Objects which have one.
     """
     
     _Min_Id = 3
@@ -103,23 +130,20 @@ class _ObjTableBase(object):
         """
         self._obj_map = weakref.WeakValueDictionary()
     
-    def free_obj(self, objId):
-        """
-        Remove the Object from the global table.
-        """
-        self._obj_map.pop(objId, None)
-        
     def get_all_obj(self):
         """
-        Return a list of all Objects
+        Return a list of all Objects.  Not every Object is
+        in the table, so they are found through the python
+        garbage collector.  Image save copies are left out.
         """
-        return list(self._obj_map.values())
+        return [obj for obj in gc.get_objects() \
+                if isinstance(obj, Object) and not hasattr(obj, "_is_copy")]
         
     def size(self):
         """
         Return the number of Objects
         """
-        return len(self._obj_map)
+        return len(self.get_all_obj())
         
     def get_obj_map(self):
         """
@@ -133,7 +157,11 @@ class _ObjTableBase(object):
         as possble.
         """
         objMap = {}
-        for objId, obj in self._obj_map.items():
+        for obj in self.get_all_obj():
+            # nil, true and false are created by the load
+            objId = obj.get_id()
+            if objId < self._Min_Id:
+                continue
             newObj = copy(obj)
             if isinstance(obj, (WeakObject, EphemObject)):
                 newObj.__class__ = Object
@@ -209,7 +237,13 @@ class Object(object):
     Smalltalk base Object definition.
     """
     
-    # this is a dictionary of all exising Objects
+    # instances have no __dict__, every Python subclass
+    # must declare its own (usually empty) __slots__.
+    # _weak_obj and _is_copy are only set when needed
+    __slots__ = ("_obj_id", "_klass", "_flags", "_refs",
+                 "_weak_obj", "_is_copy", "__weakref__")
+    
+    # this allocates the Object IDs on demand
     _Obj_Table = _ObjTableLinear()
     
     # this will point to the Smalltalk class representing
@@ -262,12 +296,24 @@ class Object(object):
             obj[n] = r
         return obj
         
+    @classmethod
+    def from_template(klass, stKlass, refs):
+        """
+        Create an instance of the Smalltalk class stKlass
+        holding a copy of the template reference list
+        """
+        obj             = klass.__new__(klass)
+        obj._obj_id     = None
+        obj._klass      = stKlass
+        obj._flags      = 0
+        obj._refs       = refs[:]
+        return obj
+        
     def __init__(self, sz):
         """
         Create a blank object
         """
-        self._py_cache  = None
-        self._obj_id    = self._Obj_Table.new_obj(self)
+        self._obj_id    = None
         self._klass     = self._Cover
         self._flags     = 0
         self.resize(sz)
@@ -307,16 +353,20 @@ class Object(object):
         
     def get_id(self):
         """
-        Return the Object's unique id (integer)
+        Return the Object's unique id (integer).  The
+        id is allocated the first time it is needed.
         """
-        return self._obj_id
+        objId = self._obj_id
+        if objId is None:
+            objId = self._obj_id = self._Obj_Table.new_obj(self)
+        return objId
         
     def is_same(self, other):
         """
         Returns True if other Object is identical to this one,
         False otherwise.
         """
-        return self._obj_id == other._obj_id
+        return self is other
         
     def is_nil(self):
         """
@@ -361,17 +411,6 @@ class Object(object):
         """
         return self.size
         
-    def __del__(self):
-        """
-        Notify when the object is out of scope
-        """
-        global _Obj_Del
-        if hasattr(self, "_is_copy"):
-            return
-        if _Obj_Del is not None:
-            _Obj_Del(self)
-        self._Obj_Table.free_obj(self._obj_id)
-        
     def __str__(self):
         """
         Convert to printable string
@@ -384,6 +423,8 @@ class UndefinedObject(Object):
     Smalltalk UndefinedObject internal representation
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self):
@@ -391,7 +432,6 @@ class UndefinedObject(Object):
         Create an UndefinedObject innstance.  This should only
         be called once.  The new object has special ID '0'.
         """
-        self._py_cache  = None
         self._obj_id    = 0
         self._klass     = self._Cover
         self._flags     = 0
@@ -409,6 +449,8 @@ class CFalse(Object):
         truthValue
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self):
@@ -416,7 +458,6 @@ class CFalse(Object):
         Create a False object innstance.  This should only
         be called once.  The new object has special ID '1'.
         """
-        self._py_cache  = None
         self._obj_id    = 1
         self._klass     = self._Cover
         self._flags     = 0
@@ -442,6 +483,8 @@ class CTrue(Object):
         truthValue
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self):
@@ -449,7 +492,6 @@ class CTrue(Object):
         Create a True object innstance.  This should only
         be called once.  The new object has special ID '2'.
         """
-        self._py_cache  = None
         self._obj_id    = 2
         self._klass     = self._Cover
         self._flags     = 0
@@ -473,6 +515,8 @@ class Array(Object):
     Internal representation of Smalltalk Array
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __str__(self):
@@ -484,6 +528,8 @@ class ByteArray(Array):
     Internal representation of Smalltalk ByteArray
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def resize(self, sz):
@@ -510,6 +556,8 @@ class Character(Object):
     Instance variables:
        codePoint
     """
+    
+    __slots__ = ()
    
     _Cover = None
     
@@ -535,9 +583,13 @@ class Character(Object):
     
 class String(Array):
     """
-    Internal representation of Smalltalk String
+    Internal representation of Smalltalk String.  Like the
+    ByteArray, the characters are stored as a python bytearray
+    and the Character objects are only produced on access.
     """
     
+    __slots__ = ()
+    
     _Cover = None
         
     @classmethod
@@ -545,33 +597,63 @@ class String(Array):
         """
         Create Smalltalk String from Python str
         """
-        global _Obj_Char
-        strObj = klass(len(s))
-        for n,c in enumerate(s):
-            strObj[n] = _Obj_Char[ord(c)]
+        strObj = klass(0)
+        strObj._refs = bytearray(s, "latin-1")
+        return strObj
+        
+    @classmethod
+    def from_bytes(klass, b):
+        """
+        Create Smalltalk String from a sequence of byte values
+        """
+        strObj = klass(0)
+        strObj._refs = bytearray(b)
         return strObj
         
+    def resize(self, sz):
+        """
+        Resize the String storage.  The old characters are
+        not preserved, the new ones all have value 0.
+        """
+        self._refs = bytearray(sz)
+        
+    def get_refs(self):
+        """
+        Return a copy of this Object's references
+        """
+        return bytearray(self._refs)
+        
     def to_str(self):
         """
         Return the String contents as a Python str
         """
-        s = ""
-        for c in self:
-            if not c.is_nil():
-                s += chr(c[0])
-        return s
+        return self._refs.decode("latin-1")
+        
+    def __getitem__(self, idx):
+        """
+        Get one of the String's Characters
+        """
+        global _Obj_Char
+        return _Obj_Char[self._refs[idx]]
+        
+    def __setitem__(self, idx, x):
+        """
+        Set one of the String's Characters.  Raises
+        ValueError if x is not a Character.
+        """
+        if not isinstance(x, Character):
+            raise ValueError("String element must be a Character")
+        self._refs[idx] = x.codePoint
         
     def __str__(self):
         """
         Print object string
         """
         s = "\'"
-        for c in self:
-            if not c.is_nil():
-                c = chr(c[0])
-                if (c.isspace() or not c.isprintable()) and (c != ' '):
-                    c = "\\%02X" % ord(c)
-                s += c
+        for c in self.to_str():
+            if (c.isspace() or not c.isprintable()) and (c != ' '):
+                c = "\\%02X" % ord(c)
+            s += c
         return s + "\'"
         
         
@@ -580,6 +662,9 @@ class Symbol(String):
     Internal representation of a Smalltalk Symbol
     """
     
+    # the Python str for the Symbol
+    __slots__ = ("_py_cache",)
+    
     _Cover = None
         
     @classmethod
@@ -596,6 +681,7 @@ class Symbol(String):
         Symbol constructor
         """
         super().__init__(sz)
+        self._py_cache = None
         self.make_readonly()
             
     def to_str(self):
@@ -621,6 +707,8 @@ class SymLink(Object):
         symbol
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, symObj, linkObj):
@@ -657,6 +745,8 @@ class SymbolTableArray(Array):
     Internal representation of Smalltalk SymbolTable
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     
@@ -665,6 +755,8 @@ class Message(Object):
     Internal representation of a Smalltalk Message
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, sel, args):
@@ -700,6 +792,8 @@ class Association(Object):
         value
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, keyObj, valueObj):
@@ -739,6 +833,8 @@ class VariableBinding(Object):
         environment
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, keyObj, valueObj, envObj):
@@ -784,6 +880,8 @@ class _Dict(Object):
     common to dictionary objects.
     """
     
+    __slots__ = ()
+    
     @classmethod
     def new_n(klass, n):
         """
@@ -819,6 +917,8 @@ class Dictionary(_Dict):
         tally
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     @staticmethod
@@ -841,6 +941,8 @@ class BindingDictionary(_Dict):
         environment
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     @staticmethod
@@ -871,6 +973,8 @@ class MethodDictionary(_Dict):
         mutex
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     @staticmethod
@@ -904,6 +1008,8 @@ class Namespace(_Dict):
         sharedPools
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     @staticmethod
@@ -968,6 +1074,10 @@ class Class(Object):
         pragmaHandlers
     """
     
+    # _new_tmpl is the interpreter's allocation
+    # template for instances of the class
+    __slots__ = ("_new_tmpl",)
+    
     _Cover = None
     
     def __init__(self, superKlass, numInstVars, isFixed):
@@ -975,6 +1085,7 @@ class Class(Object):
         Create a Class object
         """
         super().__init__(12)
+        self._new_tmpl      = None
         self.superClass     = superKlass
         self.instanceSpec   = numInstVars << 12
         if isFixed:
@@ -1010,6 +1121,7 @@ class Class(Object):
     @instanceSpec.setter
     def instanceSpec(self, x):
         self[2] = x
+        self._new_tmpl = None
         
     @property
     def subClasses(self):
@@ -1099,6 +1211,8 @@ class Metaclass(Object):
         instanceClass
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, instKlass):
@@ -1162,81 +1276,123 @@ class Metaclass(Object):
 class _Context(Object):
     """
     Not a real Smalltalk class, but encapsulates
-    common behavior of context objects.
+    common behavior of context objects.  The fixed
+    fields are kept in slots and the references
+    list only holds the temporaries and stack, so
+    the stack pointer is computed from its length.
+    Indexing still presents the usual layout.
     """
     
+    __slots__ = ("parent", "native_ip", "ip", "receiver", "method")
+    
+    # fixed field names by index
+    _Fields = ("parent", "native_ip", "ip", "sp", "receiver", "method")
+    
     def __init__(self):
         """
         Create a new context
         """
         super().__init__(7)
         self.ip = 0
-        self.sp = 6
         
     @property
-    def parent(self):
-        return self[0]
-        
-    @parent.setter
-    def parent(self, x):
-        self[0] = x
-  
-    @property
-    def native_ip(self):
-        return self[1]
+    def size(self):
+        return 7 + len(self._refs)
         
-    @native_ip.setter
-    def native_ip(self, x):
-        self[1] = x
+    def resize(self, sz):
+        """
+        Clear the fixed fields and make room
+        for sz - 7 temporaries and stack values
+        """
+        global _Obj_Nil
+        self.parent = _Obj_Nil
+        self.native_ip = _Obj_Nil
+        self.ip = _Obj_Nil
+        self.receiver = _Obj_Nil
+        self.method = _Obj_Nil
+        setattr(self, self._Fields[6], _Obj_Nil)
+        self._refs = [_Obj_Nil] * (sz - 7)
         
-    @property
-    def ip(self):
-        return self[2]
+    def get_refs(self):
+        """
+        Return a copy of the temporaries and stack
+        """
+        return [ref for ref in self._refs]
         
-    @ip.setter
-    def ip(self, x):
-        self[2] = x
-  
     @property
     def sp(self):
-        return self[3]
+        return 6 + len(self._refs)
         
     @sp.setter
     def sp(self, x):
-        self[3] = x
-        
-    @property
-    def receiver(self):
-        return self[4]
-        
-    @receiver.setter
-    def receiver(self, x):
-        self[4] = x
+        global _Obj_Nil
+        refs = self._refs
+        n = x - 6
+        if n < len(refs):
+            del refs[n:]
+        else:
+            refs.extend((_Obj_Nil,) * (n - len(refs)))
         
-    @property
-    def method(self):
-        return self[5]
+    def __getitem__(self, idx):
+        """
+        Get one of the Object's child references
+        """
+        if idx >= 7:
+            return self._refs[idx - 7]
+        if idx < 0:
+            return self._refs[idx]
+        return getattr(self, self._Fields[idx])
         
-    @method.setter
-    def method(self, x):
-        self[5] = x
+    def __setitem__(self, idx, x):
+        """
+        Set one of the Object's child references
+        """
+        if idx >= 7:
+            self._refs[idx - 7] = x
+        elif idx < 0:
+            self._refs[idx] = x
+        else:
+            setattr(self, self._Fields[idx], x)
         
     def push(self, x):
         """
         Push a new item onto the context stack
         """
         self._refs.append(x)
-        self.sp += 1
         
     def pop(self):
         """
         Pop an item from the context stack
         """
-        if self.size == 7:
+        if not self._refs:
             raise SmalltalkException("stack underflow")
-        self.sp -= 1
         return self._refs.pop()
         
+    def push_args(self, argList, numTemp):
+        """
+        Push a sequence of argument values followed
+        by space for the temporary variables onto the
+        context stack in one step.
+        """
+        global _Obj_Nil
+        refs = self._refs
+        refs.extend(argList)
+        if numTemp:
+            refs.extend((_Obj_Nil,) * numTemp)
+        
+    def take_args(self, argList, numTemp):
+        """
+        Use a list of argument values as the context
+        stack and add space for the temporary variables,
+        so the stack is built once at the size given in
+        the method header.  The list becomes owned by
+        the context.
+        """
+        global _Obj_Nil
+        if numTemp:
+            argList.extend((_Obj_Nil,) * numTemp)
+        self._refs = argList
+        
     def expand(self, n):
         """
         Increase the context stack space a number
@@ -1244,8 +1400,32 @@ class _Context(Object):
         """
         global _Obj_Nil
         self._refs.extend((_Obj_Nil,) * n)
-        self.sp += n
         
+    def is_escaped(self):
+        """
+        Return True if the context may be referenced
+        after it returns.  Object flag 0x40 marks a context
+        that escaped, 0x80 one whose senders escaped too.
+        """
+        return (self._flags & 0x40) != 0
+        
+    def make_escaped(self):
+        """
+        Mark the context as referenced by a BlockClosure
+        """
+        self._flags |= 0x40
+        
+    def make_escaped_all(self):
+        """
+        Mark the context and its senders as referenced by
+        thisContext.  The walk stops at the first sender
+        already marked, so repeated use is cheap.
+        """
+        ctx = self
+        while not (ctx.is_nil() or (ctx._flags & 0x80)):
+            ctx._flags |= 0xc0
+            ctx = ctx.parent
+            
 
 class BlockContext(_Context):
     """
@@ -1261,15 +1441,51 @@ class BlockContext(_Context):
         <stack>
     """
     
+    # home is the MethodContext a non-local return leaves and
+    # scopes holds the outerContext chain indexed by scope level,
+    # neither is visible to Smalltalk
+    __slots__ = ("outerContext", "home", "scopes")
+    
+    _Fields = _Context._Fields + ("outerContext",)
+    
     _Cover = None
+    
+    def __init__(self):
+        """
+        Create a new context
+        """
+        super().__init__()
+        self.home = _Obj_Nil
+        self.scopes = ()
         
-    @property
-    def outerContext(self):
-        return self[6]
-        
-    @outerContext.setter
-    def outerContext(self, x):
-        self[6] = x
+    def reset(self):
+        """
+        Clear the context for reuse
+        """
+        global _Obj_Nil
+        self.parent = _Obj_Nil
+        self.native_ip = _Obj_Nil
+        self.ip = 0
+        self.receiver = _Obj_Nil
+        self.method = _Obj_Nil
+        self.outerContext = _Obj_Nil
+        self.home = _Obj_Nil
+        self.scopes = ()
+        self._refs = []
+        
+    def set_outer(self, outer):
+        """
+        Link the context to the one its block was
+        created in, to the home method context and
+        to every outer context by scope level
+        """
+        self.outerContext = outer
+        if isinstance(outer, BlockContext):
+            self.home = outer.home
+            self.scopes = (outer,) + outer.scopes
+        else:
+            self.home = outer
+            self.scopes = (outer,)
         
         
 class MethodContext(_Context):
@@ -1286,6 +1502,10 @@ class MethodContext(_Context):
         <stack>
     """
     
+    __slots__ = ("flags",)
+    
+    _Fields = _Context._Fields + ("flags",)
+    
     _Cover = None
     
     def __init__(self):
@@ -1295,13 +1515,18 @@ class MethodContext(_Context):
         super().__init__()
         self.flags = 0
         
-    @property
-    def flags(self):
-        return self[6]
-        
-    @flags.setter
-    def flags(self, x):
-        self[6] = x
+    def reset(self):
+        """
+        Clear the context for reuse
+        """
+        global _Obj_Nil
+        self.parent = _Obj_Nil
+        self.native_ip = _Obj_Nil
+        self.ip = 0
+        self.receiver = _Obj_Nil
+        self.method = _Obj_Nil
+        self.flags = 0
+        self._refs = []
         
         
 class _Code(Object):
@@ -1311,6 +1536,10 @@ class _Code(Object):
     objects.
     """
     
+    # _py_cache holds anything the interpreter
+    # derives from the bytecodes
+    __slots__ = ("_bc_arr", "_py_cache")
+    
     def __init__(self):
         """
         Create a new code object.  Extend the usual
@@ -1319,6 +1548,7 @@ class _Code(Object):
         """
         super().__init__(3)
         self._bc_arr = bytearray(2)
+        self._py_cache = None
         self.make_readonly()
  
     def get_code(self):
@@ -1329,9 +1559,11 @@ class _Code(Object):
 
     def set_code(self, x):
         """
-        Set the bytecode array
+        Set the bytecode array.  Anything the
+        interpreter derived from the old code is dropped.
         """
         self._bc_arr = x
+        self._py_cache = None
         
     @property
     def size(self):
@@ -1361,10 +1593,16 @@ class _Code(Object):
         
     def __getitem__(self, idx):
         """
-        Get one of the Object's child references
+        Get one of the Object's child references.
+        Superinstructions are shown to Smalltalk as
+        the first bytecode of the sequence they replace.
         """
         if idx >= 3:
-            return self._bc_arr[idx - 3]
+            x = self._bc_arr[idx - 3]
+            if (x >= B_SEND_UNARY_LIT) and not ((idx - 3) & 1):
+                # an opcode position, not an operand
+                return B_SUPER[x][0]
+            return x
         return self._refs[idx]
         
     def __setitem__(self, idx, x):
@@ -1373,6 +1611,7 @@ class _Code(Object):
         """
         if idx >= 3:
             self._bc_arr[idx - 3] = x
+            self._py_cache = None
         else:
             self._refs[idx] = x
      
@@ -1387,6 +1626,10 @@ class CompiledMethod(_Code):
         <bytecode>
     """
     
+    # _quick holds the quick method kind and index,
+    # it is not visible to Smalltalk
+    __slots__ = ("_quick",)
+    
     _Cover = None
     
     def __init__(self):
@@ -1395,6 +1638,7 @@ class CompiledMethod(_Code):
         """
         super().__init__()
         self.header = 0
+        self._quick = 0
         
     def set_hdr(self, numArg, numTemp, depth, primId):
         """
@@ -1440,6 +1684,20 @@ class CompiledMethod(_Code):
         """
         return (self.header >> 17) & 0x1ff
         
+    def set_quick(self, kind, index):
+        """
+        Flag a trivial method with its quick method
+        kind and instance variable or literal index
+        """
+        self._quick = (kind & 0x7) | ((index & 0xff) << 3)
+        
+    def get_quick(self):
+        """
+        Get the quick method flags, 0 if none.  The
+        kind is in the low 3 bits and the index above.
+        """
+        return self._quick
+        
     @property    
     def descriptor(self):
         return self[2]
@@ -1469,15 +1727,23 @@ class CompiledBlock(_Code):
         <bytecode>
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
-    def set_hdr(self, numArg, numTemp, depth):
+    # clean-ness flags values
+    CLEAN       = 0
+    SELF        = 1
+    FULL        = 31
+    
+    def set_hdr(self, numArg, numTemp, depth, flags = 0):
         """
         Set the method header info
         """
         self.header = (numArg & 0x1f) | \
                       ((numTemp & 0x3f) << 11) | \
-                      ((depth & 0x3f) << 5)
+                      ((depth & 0x3f) << 5) | \
+                      ((flags & 0x1f) << 17)
                       
     def get_hdr(self):
         """
@@ -1507,6 +1773,16 @@ class CompiledBlock(_Code):
         """
         return (self.header >> 5) & 0x3f
         
+    def get_flags(self):
+        """
+        Get the clean-ness flags of the block:
+        0 = clean, no closure state is needed
+        1 = access to self or receiver variables
+        2-30 = access to variables 1-29 contexts away
+        31 = return from method or thisContext
+        """
+        return (self.header >> 17) & 0x1f
+        
     @property
     def method(self):
         return self[2]
@@ -1533,6 +1809,8 @@ class MethodInfo(Object):
         debugInfo
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, linkKlass):
@@ -1593,6 +1871,8 @@ class BlockClosure(Object):
         receiver
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, outer, blk, recv):
@@ -1634,8 +1914,19 @@ class BlockClosure(Object):
 
 class LargeInteger(ByteArray):
     """
-    Internal representation of Smalltalk LargeInteger
+    Internal representation of Smalltalk LargeInteger.
+    The value is kept as a python int and the little
+    endian digit bytes are only produced when Smalltalk
+    code looks at them.  Changing the bytes drops the int
+    until it is needed again.
     """
+    
+    # _py_int is the value, _py_bytes the digits,
+    # at least one of them is always valid
+    __slots__ = ("_py_int", "_py_bytes")
+    
+    # digits are two's complement
+    _Signed = False
 
     @classmethod
     def from_int(klass, x):
@@ -1643,15 +1934,59 @@ class LargeInteger(ByteArray):
         Create a LargeInteger from a python int
         """
         if abs(x) <= Int_Max:
-            obj = x
-        elif x > 0:
-            length = (x.bit_length() + 7) // 8
-            obj = LargePositiveInteger.from_seq(x.to_bytes(length, 'little', signed = False))
+            return x
+        if x > 0:
+            obj = LargePositiveInteger(0)
         else:
-            length = (x.bit_length() + 8) // 8
-            obj = LargeNegativeInteger.from_seq(x.to_bytes(length, 'little', signed = True))
+            obj = LargeNegativeInteger(0)
+        obj._py_bytes = None
+        obj._py_int = x
         return obj
         
+    def to_int(self):
+        """
+        Return LargeInteger value as a python int
+        """
+        x = self._py_int
+        if x is None:
+            x = int.from_bytes(self._py_bytes, 'little', signed = self._Signed)
+            self._py_int = x
+        return x
+        
+    def _num_bytes(self):
+        """
+        Return the number of digit bytes needed for the int value
+        """
+        if self._Signed:
+            return (self._py_int.bit_length() + 8) // 8
+        return (self._py_int.bit_length() + 7) // 8
+        
+    @property
+    def _refs(self):
+        b = self._py_bytes
+        if b is None:
+            b = bytearray(self._py_int.to_bytes(self._num_bytes(), 'little', signed = self._Signed))
+            self._py_bytes = b
+        return b
+        
+    @_refs.setter
+    def _refs(self, x):
+        self._py_bytes = x
+        self._py_int = None
+        
+    def __setitem__(self, idx, x):
+        """
+        Set one of the digit bytes
+        """
+        self._refs[idx] = x
+        self._py_int = None
+        
+    @property
+    def size(self):
+        if self._py_bytes is None:
+            return self._num_bytes()
+        return len(self._py_bytes)
+        
     def __str__(self):
         return "LARGEINT(" + str(self.to_int()) + ")"
         
@@ -1661,27 +1996,21 @@ class LargePositiveInteger(LargeInteger):
     Internal representation of Smalltalk LargePositiveInteger
     """
     
-    _Cover = None
+    __slots__ = ()
     
-    def to_int(self):
-        """
-        Return LargeInteger value as a python int
-        """
-        return int.from_bytes(self._refs, 'little', signed = False)
+    _Cover = None
     
     
 class LargeNegativeInteger(LargeInteger):
     """
-    Internal representation of Smalltalk LargePositiveInteger
+    Internal representation of Smalltalk LargeNegativeInteger
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
-    def to_int(self):
-        """
-        Return LargeInteger value as a python int
-        """
-        return int.from_bytes(self._refs, 'little', signed = True)
+    _Signed = True
     
     
 class LargeZeroInteger(LargePositiveInteger):
@@ -1689,6 +2018,8 @@ class LargeZeroInteger(LargePositiveInteger):
     Internal representation of Smalltalk LargePositiveInteger
     """
     
+    __slots__ = ()
+    
     _Cover = None
 
         
@@ -1700,6 +2031,8 @@ class Fraction(Object):
         denominator
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, num, denom):
@@ -1732,6 +2065,8 @@ class FloatE(ByteArray):
     Internal representation of Smalltalk FloatE
     """
     
+    __slots__ = ()
+    
     _Cover = None
 
     @classmethod
@@ -1775,6 +2110,8 @@ class FileStream(Object):
         writeEnd
     """
     
+    __slots__ = ()
+    
     _Cover = None
     
     def __init__(self, fileDesc, fileName, accFlags):
@@ -1878,22 +2215,51 @@ class FileStream(Object):
         self[10] = x
         
         
+class StrongRef(object):
+    """
+    Stand in for a weak reference to a value that
+    is never garbage collected (SmallInteger, Float)
+    """
+    
+    __slots__ = ("_value",)
+    
+    def __init__(self, x):
+        """
+        Create a StrongRef
+        """
+        self._value = x
+        
+    def __call__(self):
+        """
+        Return the referenced value
+        """
+        return self._value
+        
+        
 class WeakObject(Object):
     """
     Internal representation of Smalltalk objects that
     contain weak references.
     """
+    
+    __slots__ = ()
 
     @classmethod
     def from_obj(klass, x):
         """
-        Create a Weak from another Object
+        Make another Object weak.  This is done in place, so
+        the Object keeps its identity and references to it
+        stay valid.  Raises TypeError if the python layout
+        of the Object is not a plain one.
         """
         if isinstance(x, WeakObject):
             return x
-        newObj = klass.from_seq(x)
-        newObj._klass = x.get_class()
-        return newObj
+        refs = x.get_refs()
+        x.__class__ = klass
+        x.resize(len(refs))
+        for n,r in enumerate(refs):
+            x[n] = r
+        return x
     
     def resize(self, sz):
         """
@@ -1928,12 +2294,20 @@ class WeakObject(Object):
             if not len(current._weak_obj):
                 delattr(current, "_weak_obj")
                 
-        # add reference to self in added item
+        # SmallIntegers and Floats are never collected
+        if not is_obj(x):
+            self._refs[idx] = StrongRef(x)
+            return
+            
+        # add reference to self in added item, the first
+        # weak owner registers the finalizer for the item
         if hasattr(x, "_weak_obj"):
             if self not in x._weak_obj:
                 x._weak_obj.append(self)
         else:
             x._weak_obj = [self]
+            if isinstance(x, Object):
+                weakref.finalize(x, obj_finalize, x._weak_obj)
             
         # store new item reference
         self._refs[idx] = weakref.ref(x)
@@ -1947,47 +2321,70 @@ class WeakObject(Object):
         
 class EphemObject(WeakObject):
     """
-    Internal representation of Smalltalk ephemeron object that
-    contain a weak reference.
+    Internal representation of Smalltalk ephemeron object.
+    The first object item is held until the ephemeron is
+    the only reference to it, then the ephemeron is mourned.
     """
     
+    __slots__ = ()
+    
+    # ephemerons with an object as their first item
+    _Ephem_Live = weakref.WeakSet()
+    
+    # reference count of an item that is only held by the
+    # ephemeron, measured on a probe when the module loads
+    # since what sys.getrefcount counts differs by version
+    _Ref_Last = None
+    
+    @staticmethod
+    def key_refs(refs):
+        """
+        Return the reference count of the first item
+        in an ephemeron item list
+        """
+        key = refs[0]
+        return sys.getrefcount(key)
+        
     @classmethod
-    def from_obj(klass, x):
+    def find_mourners(klass):
         """
-        Create an Ephemeron from a Python sequence
+        Return the ephemerons whose first item is no longer
+        referenced anywhere else.  They stop being ephemerons
+        until a new first item is stored.  Items that refer
+        back to themselves are never found.
         """
-        if isinstance(x, EphemObject):
-            return x
-        return super().from_obj(x)
+        mournList = []
+        for ephem in list(klass._Ephem_Live):
+            if klass.key_refs(ephem._refs) <= klass._Ref_Last:
+                klass._Ephem_Live.discard(ephem)
+                mournList.append(ephem)
+        return mournList
     
     def resize(self, sz):
         """
-        Resize the reference storage arrary for this weak object.
-        A weak references is used for the first object item.
+        Resize the reference storage arrary for this ephemeron.
         This will not preserve the old references.
         """
         global _Obj_Nil
-        self._refs = [weakref.ref(_Obj_Nil)]
-        self._refs.extend((_Obj_Nil,) * (sz - 1))
+        self._refs = [_Obj_Nil] * sz
         
     def __getitem__(self, idx):
         """
         Get one of the Object's child references
         """
-        if idx == 0:
-            x = super().__getitem__(idx)
-        else:
-            x = self._refs[idx]
-        return x
+        return self._refs[idx]
         
     def __setitem__(self, idx, x):
         """
         Set one of the Object's child references
         """
+        global _Obj_Nil
+        self._refs[idx] = x
         if idx == 0:
-            super().__setitem__(idx, x)
-        else:
-            self._refs[idx] = x
+            if is_obj(x) and (x is not _Obj_Nil):
+                self._Ephem_Live.add(self)
+            else:
+                self._Ephem_Live.discard(self)
         
     def __str__(self):
         """
@@ -1995,12 +2392,17 @@ class EphemObject(WeakObject):
         """
         return "EPHEMOBJ{" + str(self._klass) + "[" + str(self.size) + "]}"
 
+# an item list holding the only reference to a probe
+EphemObject._Ref_Last = EphemObject.key_refs([object()])
+
 
 class DirIter(Object):
     """
     Represent opaque iterator over a directory listing
     """
     
+    __slots__ = ()
+    
     def __init__(self, dirList):
         """
         Initialize directory entry iterator
@@ -2100,3 +2502,42 @@ B_LINE_NUMBER_BYTECODE      = 54
 B_EXT_BYTE                  = 55 
 B_PUSH_SELF                 = 56
 
+# superinstructions
+# these replace the opcode of the first instruction of a
+# common sequence, the bytes of the following instructions
+# are left unchanged so the code length and jump offsets
+# are not affected
+B_SEND_UNARY_LIT            = 64
+B_PUSH_SELF_PUSH_LIT        = 65
+B_PUSH_TEMP_PUSH_LIT        = 66
+B_PUSH_LIT_PUSH_TEMP        = 67
+B_PUSH_TEMP_PUSH_TEMP       = 68
+B_STORE_TEMP_PUSH_TEMP      = 69
+B_POP_PUSH_SELF             = 70
+B_POP_PUSH_TEMP             = 71
+B_PUSH_TEMPS_SPECIAL        = 72
+
+# the instruction sequence replaced by each superinstruction
+# None matches any special send bytecode
+B_SUPER = {
+    B_SEND_UNARY_LIT        : (B_PUSH_LIT_CONSTANT, B_SEND),
+    B_PUSH_SELF_PUSH_LIT    : (B_PUSH_SELF, B_PUSH_LIT_CONSTANT),
+    B_PUSH_TEMP_PUSH_LIT    : (B_PUSH_TEMPORARY_VARIABLE, B_PUSH_LIT_CONSTANT),
+    B_PUSH_LIT_PUSH_TEMP    : (B_PUSH_LIT_CONSTANT, B_PUSH_TEMPORARY_VARIABLE),
+    B_PUSH_TEMP_PUSH_TEMP   : (B_PUSH_TEMPORARY_VARIABLE, B_PUSH_TEMPORARY_VARIABLE),
+    B_STORE_TEMP_PUSH_TEMP  : (B_STORE_TEMPORARY_VARIABLE, B_PUSH_TEMPORARY_VARIABLE),
+    B_POP_PUSH_SELF         : (B_POP_STACK_TOP, B_PUSH_SELF),
+    B_POP_PUSH_TEMP         : (B_POP_STACK_TOP, B_PUSH_TEMPORARY_VARIABLE),
+    B_PUSH_TEMPS_SPECIAL    : (B_PUSH_TEMPORARY_VARIABLE, B_PUSH_TEMPORARY_VARIABLE, None),
+}
+
+# quick method kinds
+# trivial methods flagged by the compiler
+# are run by the interpreter without a context
+Q_RETURN_SELF               = 1
+Q_RETURN_INST_VAR           = 2
+Q_RETURN_LITERAL            = 3
+Q_RETURN_INTEGER            = 4
+Q_RETURN_ARG                = 5
+Q_SET_INST_VAR              = 6
+
@@ -5,6 +5,7 @@ The entire Smalltalk environment
 from st import *
 from compiler import Compile
 from interp import Interp
+from translate import Translate
 import init
 import dill
 import gc
@@ -228,14 +229,15 @@ class Smalltalk(object):
         # initialize interpreter
         # no Objects should be deleted before this point
         inst.g_interp = Interp(inst)
+        inst.g_interp.set_threaded(not args.no_threaded)
+        inst.g_interp.set_pool_limit(args.pool_limit)
         set_obj_del(inst.g_interp.delete_object)
         
         # setup requested debug options
         if brkpoint is not None:
             # break at [Class, method]
             inst.d_breakpoint = brkpoint
-            inst.d_save = inst.g_interp.get_debug()
-            inst.g_interp.set_debug(inst.break_hook_pre, inst.d_save[1])
+            inst.g_interp.set_break(inst.break_hook_entry)
         
         # initialize primitive ops
         inst.build_primitives(args.verbose)
@@ -321,20 +323,22 @@ class Smalltalk(object):
         
         # get the remainder of the objects
         inst.load_objects(objMap)
+        inst.load_contexts(objMap)
         set_obj_char(inst.o_char)
         Object.set_obj_map(objMap)
         
         # initialize interpreter
         # no Objects should be deleted before this point
         inst.g_interp = Interp(inst)
+        inst.g_interp.set_threaded(not args.no_threaded)
+        inst.g_interp.set_pool_limit(args.pool_limit)
         set_obj_del(inst.g_interp.delete_object)
         
         # setup requested debug options
         if brkpoint is not None:
             # break at [Class, method]
             inst.d_breakpoint = brkpoint
-            inst.d_save = inst.g_interp.get_debug()
-            inst.g_interp.set_debug(inst.break_hook_pre, inst.d_save[1])
+            inst.g_interp.set_break(inst.break_hook_entry)
             
         # initialize primitive ops
         inst.load_primitives(args.verbose)
@@ -440,6 +444,16 @@ class Smalltalk(object):
             # delete weak obj list
             if hasattr(obj, "_weak_obj"):
                 delattr(obj, "_weak_obj")
+            # delete interpreter code caches
+            if isinstance(obj, (CompiledMethod, CompiledBlock)):
+                obj._py_cache = None
+            # delete allocation templates
+            if isinstance(obj, Class):
+                obj._new_tmpl = None
+            # delete cached outer context links
+            if isinstance(obj, BlockContext):
+                obj.home = None
+                obj.scopes = None
             # break references and replace with IDs
             try:
                 ref = refCache[obj.get_class().get_id()]
@@ -447,6 +461,9 @@ class Smalltalk(object):
                 ref = ObjectReference(obj.get_class())
                 refCache[ref.get_id()] = ref
             obj.set_class(ref)
+            if isinstance(obj, String):
+                # String characters are stored as bytes
+                continue
             for n,r in enumerate(obj):
                 if is_obj(r):
                     try:
@@ -536,22 +553,24 @@ class Smalltalk(object):
             if not isinstance(obj, Class):
                 
                 # fixup references in object
+                # String characters are stored as bytes
                 obj.set_class(objMap[obj.get_class().get_id()])
-                for n,r in enumerate(obj):
-                    if isinstance(r, ObjectReference):
-                        objId = r.get_id()
-                        if objId == 0:
-                            obj[n] = self.o_nil
-                        elif objId == 1:
-                            obj[n] = self.o_false
-                        elif objId == 2:
-                            obj[n] = self.o_true
-                        else:
-                            try:
-                                obj[n] = objMap[objId]
-                            except KeyError:
-                                print("warning: missing ref:", r)
+                if not isinstance(obj, String):
+                    for n,r in enumerate(obj):
+                        if isinstance(r, ObjectReference):
+                            objId = r.get_id()
+                            if objId == 0:
                                 obj[n] = self.o_nil
+                            elif objId == 1:
+                                obj[n] = self.o_false
+                            elif objId == 2:
+                                obj[n] = self.o_true
+                            else:
+                                try:
+                                    obj[n] = objMap[objId]
+                                except KeyError:
+                                    print("warning: missing ref:", r)
+                                    obj[n] = self.o_nil
                             
                 # look for special objects
                 klass = obj.get_class()
@@ -565,6 +584,31 @@ class Smalltalk(object):
                     # global symbol table
                     self.e_sym_table = obj
             
+    def load_contexts(self, objMap):
+        """
+        Rebuild the home context and scope levels
+        of every block context from its outerContext chain
+        """
+        for obj in objMap.values():
+            if isinstance(obj, BlockContext):
+                self.load_block_context(obj)
+                
+    def load_block_context(self, ctx):
+        """
+        Link a block context to its outer contexts,
+        outermost first
+        """
+        if ctx.scopes is not None:
+            return
+        outer = ctx.outerContext
+        if outer.is_nil():
+            ctx.home = outer
+            ctx.scopes = ()
+            return
+        if isinstance(outer, BlockContext):
+            self.load_block_context(outer)
+        ctx.set_outer(outer)
+            
     def build_classes_1(self):
         """
         Class rebuild
@@ -655,7 +699,7 @@ class Smalltalk(object):
             metaObj.instanceVariables = self.create_inst_vars(self.o_nil, metaVars)
             if not superObj.is_nil():
                 self.subclass_add(superObj, klassObj)
-            metaObj.methodDictioary = self.o_nil
+            metaObj.methodDictionary = self.o_nil
             klassObj.environment = self.e_st_dict
             klassObj.instanceVariables = self.create_inst_vars(superObj, instVars)
             klassObj.classVariables = self.create_class_vars(klassObj, classVars)
@@ -694,6 +738,10 @@ class Smalltalk(object):
         disTbl[B_STORE_TEMPORARY_VARIABLE]  = ("STORE_TEMP_VARIABLE",       2, 1)
         disTbl[B_STORE_RECEIVER_VARIABLE]   = ("STORE_RECV_VARIABLE",       2, 1)
         disTbl[B_STORE_OUTER_TEMP]          = ("STORE_OUTER_VARIABLE",      4, 2)
+        disTbl[B_JUMP]                      = ("JUMP",                      4, 2)
+        disTbl[B_JUMP_BACK]                 = ("JUMP_BACK",                 4, 2)
+        disTbl[B_POP_JUMP_TRUE]             = ("POP_JUMP_TRUE",             4, 2)
+        disTbl[B_POP_JUMP_FALSE]            = ("POP_JUMP_FALSE",            4, 2)
         disTbl[B_VALUE_SPECIAL]             = ("SEND_SPECIAL_VALUE",        2, 1)
         disTbl[B_SIZE_SPECIAL]              = ("SEND_SPECIAL_SIZE",         2, 1)
         disTbl[B_IS_NIL_SPECIAL]            = ("SEND_SPECIAL_ISNIL",        2, 1)
@@ -719,6 +767,15 @@ class Smalltalk(object):
         disTbl[B_BIT_OR_SPECIAL]            = ("SEND_SPECIAL_BIT_OR",       2, 1)
         disTbl[B_BIT_XOR_SPECIAL]           = ("SEND_SPECIAL_BIT_XOR",      2, 1)
         disTbl[B_BIT_SHIFT_SPECIAL]         = ("SEND_SPECIAL_BIT_SHIFT",    2, 1)
+        disTbl[B_SEND_UNARY_LIT]            = ("SEND_UNARY_LIT",            2, 1)
+        disTbl[B_PUSH_SELF_PUSH_LIT]        = ("PUSH_SELF_PUSH_LIT",        2, 1)
+        disTbl[B_PUSH_TEMP_PUSH_LIT]        = ("PUSH_TEMP_PUSH_LIT",        2, 1)
+        disTbl[B_PUSH_LIT_PUSH_TEMP]        = ("PUSH_LIT_PUSH_TEMP",        2, 1)
+        disTbl[B_PUSH_TEMP_PUSH_TEMP]       = ("PUSH_TEMP_PUSH_TEMP",       2, 1)
+        disTbl[B_STORE_TEMP_PUSH_TEMP]      = ("STORE_TEMP_PUSH_TEMP",      2, 1)
+        disTbl[B_POP_PUSH_SELF]             = ("POP_PUSH_SELF",             2, 1)
+        disTbl[B_POP_PUSH_TEMP]             = ("POP_PUSH_TEMP",             2, 1)
+        disTbl[B_PUSH_TEMPS_SPECIAL]        = ("PUSH_TEMPS_SPECIAL",        2, 1)
     
     def build_primitives(self, verbose):
         """
@@ -1081,16 +1138,13 @@ class Smalltalk(object):
             prStr = info[0]
         return prStr
         
-    def break_hook_pre(self):
+    def break_hook_entry(self, ctx):
         """
-        Check for breakpoints before execution
+        Check for breakpoints on entry to a method
         """
-        # get current context
-        ctx = self.g_interp.cur_context()
-        
-        # check for method context and get name
+        # get method name
         methObj = ctx.method
-        if (ctx.ip != 0) or methObj.is_nil() or (not is_int(ctx[6])):
+        if methObj.is_nil():
             return
         descObj = methObj.descriptor
         methName = descObj.selector
@@ -1102,7 +1156,6 @@ class Smalltalk(object):
             print()
             self.d_save = self.g_interp.get_debug()
             self.g_interp.set_debug(self.debug_hook_pre, self.debug_hook_post)
-            self.debug_hook_pre()
         
     def debug_hook_pre(self):
         """
@@ -1250,12 +1303,12 @@ class Smalltalk(object):
             numTemp = meth.get_num_arg() + meth.get_num_temp()
             if numTemp > 0:
                 print("Temps (%d):" % numTemp)
-                for n,r in enumerate(ctx[7 : 7 + numTemp]):
+                for n,r in enumerate(list(ctx)[7 : 7 + numTemp]):
                     print("[%d]" % n, r)
         else:
             numTemp = 0
         print("\nStack (%d):" % (ctx.sp - (6 + numTemp),))
-        for n,r in enumerate(ctx[7 + numTemp:]):
+        for n,r in enumerate(list(ctx)[7 + numTemp:]):
             print("[%d]" % n, r)
         
     def object_print_state(self, obj):
@@ -1266,12 +1319,58 @@ class Smalltalk(object):
         print("ID:    ", obj.get_id())
         print("Size:  ", obj.size)
         print("Flags: ", hex(obj._flags))
-        print("Cache: ", obj._py_cache)
+        print("Cache: ", getattr(obj, "_py_cache", None))
         if hasattr(obj, "_weak_obj"):
             print("Weak:  ", obj._weak_obj)
         if obj.size > 0:
             self.arr_print(obj)
             
+    @classmethod
+    def send_stats_print(klass):
+        """
+        Display the inline cache statistics for every send
+        site which has been executed
+        """
+        inst = klass._SmalltalkInstance
+        print("Send Site Caches:")
+        for codeObj, site, entry in inst.g_interp.get_send_sites():
+            if isinstance(codeObj, CompiledBlock):
+                desc = codeObj.method.descriptor
+                methName = "%s>>%s[Block]" % (desc.klass, desc.selector)
+            else:
+                desc = codeObj.descriptor
+                methName = "%s>>%s" % (desc.klass, desc.selector)
+            if entry.mega:
+                state = "MEGA"
+            else:
+                state = "%d" % len(entry.klasses)
+            print("%s [%d] %s hits %d misses %d classes %s" % \
+                  (methName, site, entry.selector, entry.hits, entry.misses, state))
+        print()
+        
+    @classmethod
+    def ngram_stats_print(klass, n, count):
+        """
+        Display the most common sequences of n bytecodes in
+        all compiled methods and blocks, used to choose the
+        superinstructions.  Superinstructions are counted
+        as the bytecodes they replace.
+        """
+        inst = klass._SmalltalkInstance
+        seqCount = {}
+        for obj in Object.get_all_obj():
+            if not isinstance(obj, (CompiledMethod, CompiledBlock)):
+                continue
+            opList = [x[1] for x in Translate.decode(obj.get_code())]
+            for k in range(len(opList) - n + 1):
+                seq = tuple(opList[k : k + n])
+                seqCount[seq] = seqCount.get(seq, 0) + 1
+        print("Bytecode %d-grams:" % n)
+        seqList = sorted(seqCount.items(), key = lambda x: x[1], reverse = True)
+        for seq, total in seqList[:count]:
+            print(total, " ".join([inst.dis_byte(b) for b in seq]))
+        print()
+            
     def object_print_all(self):
         """
         Print all of the objects
@@ -0,0 +1,439 @@
+"""
+Translation of hot compiled methods into Python functions
+"""
+
+from st import *
+
+
+class Translate(object):
+    """
+    The second execution tier.  Straight line runs of bytecodes
+    in a frequently executed CompiledMethod or CompiledBlock are
+    translated into generated Python functions, which replace the
+    first bytecode of each run in the threaded code.  Inside a run
+    the temporaries and the expression stack are Python locals.
+    The context is brought up to date whenever a function exits, so
+    sends, returns and thisContext always see the state the bytecode
+    interpreter would have produced.  When an operand does not have
+    the expected type the function writes back its state and executes
+    the original bytecode instead.
+    """
+    
+    # number of activations before a method is translated
+    _Hot_Count = 50
+    
+    # the shortest run of bytecodes worth translating
+    _Min_Run = 2
+    
+    # bytecodes which may appear inside a run
+    _Run_Ops = frozenset((B_PUSH_SELF, B_PUSH_LIT_CONSTANT, B_PUSH_TEMPORARY_VARIABLE,
+                          B_PUSH_OUTER_TEMP, B_PUSH_RECEIVER_VARIABLE, B_PUSH_INTEGER,
+                          B_DUP_STACK_TOP, B_POP_STACK_TOP, B_STORE_TEMPORARY_VARIABLE,
+                          B_STORE_OUTER_TEMP, B_STORE_RECEIVER_VARIABLE,
+                          B_PLUS_SPECIAL, B_MINUS_SPECIAL, B_TIMES_SPECIAL,
+                          B_LESS_THAN_SPECIAL, B_GREATER_THAN_SPECIAL,
+                          B_LESS_EQUAL_SPECIAL, B_GREATER_EQUAL_SPECIAL,
+                          B_EQUAL_SPECIAL, B_NOT_EQUAL_SPECIAL,
+                          B_INTEGER_DIVIDE_SPECIAL, B_REMAINDER_SPECIAL))
+        
+    # bytecodes which end a run
+    _Jump_Ops = frozenset((B_JUMP, B_JUMP_BACK, B_POP_JUMP_TRUE, B_POP_JUMP_FALSE))
+    
+    # SmallInteger and FloatD operations, the results of
+    # integer +, - and * may need a LargeInteger
+    _Arith_Ops = {
+        B_PLUS_SPECIAL          : "+",
+        B_MINUS_SPECIAL         : "-",
+        B_TIMES_SPECIAL         : "*",
+    }
+    
+    # SmallInteger and FloatD comparisons
+    _Compare_Ops = {
+        B_LESS_THAN_SPECIAL     : "<",
+        B_GREATER_THAN_SPECIAL  : ">",
+        B_LESS_EQUAL_SPECIAL    : "<=",
+        B_GREATER_EQUAL_SPECIAL : ">=",
+        B_EQUAL_SPECIAL         : "==",
+        B_NOT_EQUAL_SPECIAL     : "!=",
+    }
+    
+    # SmallInteger only operations which fail on a zero divisor
+    _Divide_Ops = {
+        B_INTEGER_DIVIDE_SPECIAL : "//",
+        B_REMAINDER_SPECIAL      : "%",
+    }
+    
+    def __init__(self, system):
+        """
+        Create a new translator
+        """
+        self._sys = system
+        
+    @classmethod
+    def decode(klass, code):
+        """
+        Return a list of (ip, op, arg, ext) for each instruction
+        in a bytecode array.  ext is the extended byte or None.
+        Superinstructions are decoded as their first bytecode.
+        """
+        insList = []
+        ip = 0
+        while ip < len(code) - 1:
+            if (ip + 3 < len(code)) and (code[ip + 2] == B_EXT_BYTE):
+                insList.append((ip, code[ip], code[ip + 1], code[ip + 3]))
+                ip += 4
+            else:
+                op = code[ip]
+                if op in B_SUPER:
+                    op = B_SUPER[op][0]
+                insList.append((ip, op, code[ip + 1], None))
+                ip += 2
+        return insList
+        
+    @classmethod
+    def jump_target(klass, ip, op, arg, ext):
+        """
+        Return the target of a jump instruction
+        """
+        offset = arg | (ext << 8)
+        if op == B_JUMP_BACK:
+            return ip + 4 - offset
+        return ip + 4 + offset
+        
+    def translatable(self, codeObj):
+        """
+        Return True if the code may be translated.  Code
+        which reifies its context with thisContext is left
+        to the bytecode interpreter.
+        """
+        return B_PUSH_SPECIAL not in [ins[1] for ins in self.decode(codeObj.get_code())]
+        
+    def find_runs(self, codeObj):
+        """
+        Return a list of runs of translatable instructions.  Runs
+        end at a jump and do not extend across a jump target.
+        """
+        insList = self.decode(codeObj.get_code())
+        targets = set()
+        for ip, op, arg, ext in insList:
+            if op in self._Jump_Ops:
+                targets.add(self.jump_target(ip, op, arg, ext))
+        
+        # literal blocks are turned into closures by the interpreter
+        blkKlass = self._sys.k_comp_block()
+        literals = codeObj.literals
+        
+        runList = []
+        run = []
+        for ins in insList:
+            ip, op, arg, ext = ins
+            if ip in targets and run:
+                runList.append(run)
+                run = []
+            if op == B_PUSH_LIT_CONSTANT:
+                lit = literals[arg]
+                ok = not (is_obj(lit) and (lit.get_class() is blkKlass))
+            else:
+                ok = (op in self._Run_Ops) or (op in self._Jump_Ops)
+            if not ok:
+                if run:
+                    runList.append(run)
+                run = []
+                continue
+            run.append(ins)
+            if op in self._Jump_Ops:
+                runList.append(run)
+                run = []
+        if run:
+            runList.append(run)
+        return [run for run in runList if len(run) >= self._Min_Run]
+        
+    def translate(self, codeObj, thread):
+        """
+        Translate a CompiledMethod or CompiledBlock.  The generated
+        functions replace the first instruction of each run in the
+        threaded code list, so a running loop picks them up at once.
+        """
+        if not self.translatable(codeObj):
+            return
+        runList = self.find_runs(codeObj)
+        if not runList:
+            return
+        
+        # names visible to the generated code
+        nameSpace = {
+            "T"             : self._sys.o_true,
+            "F"             : self._sys.o_false,
+            "Int_Max"       : Int_Max,
+            "LargeInteger"  : LargeInteger,
+        }
+        literals = codeObj.literals
+        if not literals.is_nil():
+            for n in range(literals.size):
+                nameSpace["k%d" % n] = literals[n]
+        for ip, entry in enumerate(thread):
+            if entry is not None:
+                nameSpace["h%d" % ip], nameSpace["a%d" % ip] = entry
+        
+        # generate and compile the functions
+        src = []
+        for run in runList:
+            src.extend(_RunGen(run).gen())
+            src.append("")
+        exec(compile("\n".join(src), "<translate %s>" % codeObj, "exec"), nameSpace)
+        
+        # install them
+        for run in runList:
+            ip = run[0][0]
+            thread[ip] = (nameSpace["r%d" % ip], 0)
+        
+    def source(self, codeObj):
+        """
+        Return the generated Python source for a code object,
+        for debugging.
+        """
+        return "\n".join(["\n".join(_RunGen(run).gen()) for run in self.find_runs(codeObj)])
+
+
+class _RunGen(object):
+    """
+    Generates the Python function for a single run of bytecodes.
+    The expression stack is simulated with entries of (expr, kind)
+    where kind is "val" for a Smalltalk object held in a local, "int"
+    for an integer constant, "tmp" for an unmodified temporary and
+    "cond" for a Python bool from a comparison.
+    """
+    
+    def __init__(self, run):
+        """
+        Setup for generating code
+        """
+        self._run       = run
+        self._lines     = []
+        self._stack     = []
+        self._temps     = {}
+        self._count     = 0
+        self._indent    = 1
+        
+    def gen(self):
+        """
+        Return the lines of the generated function
+        """
+        head = self._run[0][0]
+        for ip, op, arg, ext in self._run:
+            nextIp = ip + (2 if ext is None else 4)
+            if not self.gen_ins(ip, op, arg, ext, nextIp):
+                break
+        else:
+            self.gen_exit(nextIp)
+        return ["def r%d(ctx, arg):" % head,
+                "    r = ctx._refs",
+                "    rcv = ctx.receiver"] + self._lines
+        
+    def emit(self, line):
+        """
+        Add a line of code at the current indent
+        """
+        self._lines.append("    " * self._indent + line)
+        
+    def new_local(self, expr):
+        """
+        Assign an expression to a new local and return its name
+        """
+        self._count += 1
+        name = "v%d" % self._count
+        self.emit("%s = %s" % (name, expr))
+        return name
+        
+    def push(self, expr, kind):
+        """
+        Push an entry onto the simulated stack
+        """
+        self._stack.append((expr, kind))
+        
+    def pop(self):
+        """
+        Pop an entry from the simulated stack, taking it from
+        the context stack if the simulated stack is empty
+        """
+        if self._stack:
+            return self._stack.pop()
+        return (self.new_local("r.pop()"), "val")
+        
+    @staticmethod
+    def value(entry):
+        """
+        Return the expression for the Smalltalk value of an entry
+        """
+        expr, kind = entry
+        if kind == "cond":
+            return "(T if %s else F)" % expr
+        return expr
+        
+    def temp(self, n):
+        """
+        Return the local for a temporary, loading it if needed
+        """
+        if n not in self._temps:
+            self.emit("t%d = r[%d]" % (n, n))
+            self._temps[n] = False
+        return "t%d" % n
+        
+    def outer(self, level):
+        """
+        Return the expression for the outer context of a scope level
+        """
+        if level:
+            return "ctx.scopes[%d]" % level
+        return "ctx.outerContext"
+        
+    def gen_state(self, stack, ip):
+        """
+        Write back the temporaries and the stack and set
+        the instruction pointer
+        """
+        for n, dirty in sorted(self._temps.items()):
+            if dirty:
+                self.emit("r[%d] = t%d" % (n, n))
+        if stack:
+            self.emit("r.extend((%s,))" % ", ".join([self.value(e) for e in stack]))
+        self.emit("ctx.ip = %d" % ip)
+        
+    def gen_exit(self, ip):
+        """
+        Leave the run and continue at ip
+        """
+        self.gen_state(self._stack, ip)
+        self.emit("return")
+        
+    def gen_bail(self, ip, stack):
+        """
+        Leave the run and execute the original bytecode at ip
+        """
+        self.gen_state(stack, ip)
+        self.emit("return h%d(ctx, a%d)" % (ip, ip))
+        
+    def gen_ins(self, ip, op, arg, ext, nextIp):
+        """
+        Generate the code for one instruction.  Returns False
+        if the instruction ended the function.
+        """
+        if op == B_PUSH_SELF:
+            self.push("rcv", "val")
+        elif op == B_PUSH_LIT_CONSTANT:
+            self.push("k%d" % arg, "val")
+        elif op == B_PUSH_INTEGER:
+            self.push(str(arg), "int")
+        elif op == B_PUSH_TEMPORARY_VARIABLE:
+            self.push(self.temp(arg), "tmp")
+        elif op == B_PUSH_RECEIVER_VARIABLE:
+            self.push(self.new_local("rcv[%d]" % arg), "val")
+        elif op == B_PUSH_OUTER_TEMP:
+            self.push(self.new_local("%s._refs[%d]" % (self.outer(ext), arg)), "val")
+        elif op == B_DUP_STACK_TOP:
+            entry = self.pop()
+            self.push(*entry)
+            self.push(*entry)
+        elif op == B_POP_STACK_TOP:
+            self.pop()
+        elif op == B_STORE_TEMPORARY_VARIABLE:
+            val = self.value(self.pop())
+            name = "t%d" % arg
+            # copy any stack entries still referring to
+            # the old value of the temporary
+            if arg not in self._temps:
+                self._temps[arg] = True
+            for n, (expr, kind) in enumerate(self._stack):
+                if expr == name:
+                    self._stack[n] = (self.new_local(name), "val")
+            self.emit("%s = %s" % (name, val))
+            self._temps[arg] = True
+        elif op == B_STORE_RECEIVER_VARIABLE:
+            self.emit("rcv[%d] = %s" % (arg, self.value(self.pop())))
+        elif op == B_STORE_OUTER_TEMP:
+            self.emit("%s._refs[%d] = %s" % (self.outer(ext), arg, self.value(self.pop())))
+        elif op in (B_JUMP, B_JUMP_BACK):
+            self.gen_exit(Translate.jump_target(ip, op, arg, ext))
+            return False
+        elif op in (B_POP_JUMP_TRUE, B_POP_JUMP_FALSE):
+            self.gen_cond_jump(ip, op, arg, ext, nextIp)
+            return False
+        else:
+            self.gen_special(ip, op, arg)
+        return True
+        
+    def gen_cond_jump(self, ip, op, arg, ext, nextIp):
+        """
+        Generate a conditional jump at the end of a run
+        """
+        target = Translate.jump_target(ip, op, arg, ext)
+        onTrue, onFalse = (target, nextIp) if op == B_POP_JUMP_TRUE else (nextIp, target)
+        entry = self.pop()
+        expr, kind = entry
+        if kind == "cond":
+            self.emit("if %s:" % expr)
+        else:
+            self.emit("if %s is T:" % expr)
+        self._indent += 1
+        self.gen_exit(onTrue)
+        self._indent -= 1
+        if kind == "cond":
+            self.emit("else:")
+        else:
+            self.emit("elif %s is F:" % expr)
+        self._indent += 1
+        self.gen_exit(onFalse)
+        self._indent -= 1
+        
+        # not a Boolean, let the bytecode send mustBeBoolean
+        if kind != "cond":
+            self.gen_bail(ip, self._stack + [entry])
+        
+    def gen_special(self, ip, op, arg):
+        """
+        Generate an arithmetic or comparison special send
+        """
+        second = self.pop()
+        first = self.pop()
+        stack = self._stack + [first, second]
+        a = self.value(first)
+        b = self.value(second)
+        
+        # type guards, constant operands need no check
+        intTest = " and ".join(["type(%s) is int" % e for e, k in (first, second) if k != "int"])
+        fltTest = None
+        if (first[1] != "int") and (second[1] != "int") and (op not in Translate._Divide_Ops):
+            fltTest = "type(%s) is float and type(%s) is float" % (a, b)
+        if op in Translate._Divide_Ops:
+            if not ((second[1] == "int") and (second[0] != "0")):
+                intTest = " and ".join([t for t in (intTest, "%s != 0" % b) if t])
+        
+        # compute the result
+        self._count += 1
+        if op in Translate._Compare_Ops:
+            name = "c%d" % self._count
+            result = (name, "cond")
+            calc = "%s = %s %s %s" % (name, a, Translate._Compare_Ops[op], b)
+        else:
+            name = "v%d" % self._count
+            result = (name, "val")
+            calc = "%s = %s %s %s" % (name, a,
+                                      Translate._Arith_Ops.get(op) or Translate._Divide_Ops[op],
+                                      b)
+        if intTest:
+            self.emit("if %s:" % intTest)
+            self._indent += 1
+        self.emit(calc)
+        if op in Translate._Arith_Ops:
+            self.emit("if abs(%s) > Int_Max:" % name)
+            self.emit("    %s = LargeInteger.from_int(%s)" % (name, name))
+        if intTest:
+            self._indent -= 1
+            if fltTest:
+                self.emit("elif %s:" % fltTest)
+                self.emit("    " + calc)
+            self.emit("else:")
+            self._indent += 1
+            self.gen_bail(ip, stack)
+            self._indent -= 1
+        self.push(*result)